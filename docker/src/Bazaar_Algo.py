@@ -1,10 +1,41 @@
 from api_call import Item, Search
-import statistics
+import numpy as np
 
 class ValidationError(Exception):
     pass
 
 
+SERIES_VOLUMES = {"_buy": "_buyvolume", "_sell": "_sellvolume"}  # price series that get a VWAP
+
+
+class SeriesSummary:
+    """Everything the algo asks about one series, worked out together from one sort.
+
+    values is the cleaned float64 array from Item.flatten_and_check. For buy/sell prices paired
+    holds (prices, volumes) from Item.paired so the VWAP comes along too.
+
+    """
+
+    def __init__(self, values, paired=None):
+        ordered = self._ordered = np.sort(values)
+        self.count = len(values)
+        self.sum = float(values.sum())
+        self.mean = float(values.mean())
+        self.min = float(ordered[0])
+        self.max = float(ordered[-1])
+        self.median = float((ordered[(self.count - 1) // 2] + ordered[self.count // 2]) / 2)
+        trim = int(self.count * 0.05) if self.count > 5 else 0  # 5% off each end
+        self.trimmed_mean = float(ordered[trim: self.count - trim].mean())
+        self.vwap = None  # None without volume, callers pick their own fallback
+        if paired is not None and paired[1].sum() != 0:
+            prices, volumes = paired
+            self.vwap = float(np.dot(prices, volumes) / volumes.sum())
+
+    def percentile(self, q):
+        """q quantile (0 to 1) interpolated like np.percentile"""
+        return float(np.percentile(self._ordered, q * 100))
+
+
 class Item:
     def __init__(self, maxSell, maxBuy, min_buy, minSell, buy, sell, sellvolume, buyvolume):
         self._maxSell = maxSell
@@ -15,19 +46,24 @@ class Item:
         self._sell = sell
         self._sellvolume = sellvolume
         self._buyvolume = buyvolume
+        self._summaries = {}  # series attribute -> SeriesSummary, built the first time it's asked for
 
     def flatten_and_check(self, data):
-        """Ensure data is numeric."""
-        if not isinstance(data, list):
-            data = [data]
-        flat_list = []
-        for item in data:
-            if isinstance(item, list):
-                flat_list.extend([self.to_float(subitem) for subitem in item if subitem is not None])
-            else:
-                if item is not None:
-                    flat_list.append(self.to_float(item))
-        return flat_list if flat_list else [1.0]
+        """Ensure data is a numeric float64 array, [1.0] if nothing is there."""
+        if isinstance(data, np.ndarray):
+            values = data[~np.isnan(data)]  # api_call.Item marks left out values with NaN
+        else:
+            if not isinstance(data, list):
+                data = [data]
+            flat_list = []
+            for item in data:
+                if isinstance(item, list):
+                    flat_list.extend([self.to_float(subitem) for subitem in item if subitem is not None])
+                else:
+                    if item is not None:
+                        flat_list.append(self.to_float(item))
+            values = np.array(flat_list, dtype=np.float64)
+        return values if values.size else np.ones(1)
 
     def to_float(self, value):
         """Convert value to float, returning 0.0 if conversion fails."""
@@ -36,33 +72,44 @@ class Item:
         except (ValueError, TypeError):
             return 0.0
 
-    def safe_average(self, data):
-        """ calculate the average of a list of numbers with simple outlier filtering."""
-        flat_list = self.flatten_and_check(data)
-        n = len(flat_list)
-        if n > 5:
-            flat_list.sort()
-            trim = int(n * 0.05)
-            if n - 2 * trim > 0:
-                flat_list = flat_list[trim: n - trim]
-        return sum(flat_list) / len(flat_list) if flat_list else 0.0
-
-    def volume_weighted_avg(self, prices, volumes):
-        """calculate a volume-weighted average of prices."""
-        prices = self.flatten_and_check(prices)
-        volumes = self.flatten_and_check(volumes)
-        total_vol = sum(volumes)
-        if total_vol == 0:
-            return self.safe_average(prices)
-        return sum(p * v for p, v in zip(prices, volumes)) / total_vol
+    def paired(self, prices, volumes):
+        """(prices, volumes) float64 arrays of the samples that have both.
+
+        Pairing happens before anything is left out, so a missing price doesn't shift the
+        prices after it onto the wrong volumes and the order of the samples doesn't matter.
+        """
+        prices, volumes = self.aligned(prices), self.aligned(volumes)
+        count = min(len(prices), len(volumes))  # like zip, extra values on either side are ignored
+        prices, volumes = prices[:count], volumes[:count]
+        present = ~np.isnan(prices) & ~np.isnan(volumes)
+        return prices[present], volumes[present]
+
+    def aligned(self, data):
+        """data as a float64 array with NaN where a value is missing, so positions stay put"""
+        if isinstance(data, np.ndarray):
+            return data
+        if not isinstance(data, list):
+            data = [data]
+        return np.array([np.nan if value is None else self.to_float(value) for value in data], dtype=np.float64)
+
+    def summary(self, series):
+        """Cached SeriesSummary of one series, e.g. summary("_buy")"""
+        if series not in self._summaries:
+            volume = SERIES_VOLUMES.get(series)
+            data = getattr(self, series)
+            self._summaries[series] = SeriesSummary(
+                self.flatten_and_check(data),
+                self.paired(data, getattr(self, volume)) if volume else None,
+            )
+        return self._summaries[series]
 
     def get_avg_sell_volume(self):
         """Get Average Sell Volume"""
-        return self.safe_average(self._sellvolume)
+        return self.summary("_sellvolume").trimmed_mean
 
     def get_avg_buy_volume(self):
         """Get Average Buy Volume"""
-        return self.safe_average(self._buyvolume)
+        return self.summary("_buyvolume").trimmed_mean
 
     def get_sell(self):
         """Get current sell value"""
@@ -70,45 +117,45 @@ class Item:
 
     def get_avg_buy(self):
         """Calculates Average buy of an item"""
-        return self.safe_average(self._buy)
+        return self.summary("_buy").trimmed_mean
 
     def get_avg_sell(self):
         """Calculates average sell of items"""
-        return self.safe_average(self._sell)
+        return self.summary("_sell").trimmed_mean
 
     def get_avg_minsell(self):
         """Calculates average min sell of an item"""
-        return self.safe_average(self._minSell)
+        return self.summary("_minSell").trimmed_mean
 
     def get_avg_minbuy(self):
         """Calculates average min buy of an item"""
-        return self.safe_average(self._min_buy)
+        return self.summary("_min_buy").trimmed_mean
 
     def get_avg_maxbuy(self):
         """Calculates average max buy of an item"""
-        return self.safe_average(self._maxBuy)
+        return self.summary("_maxBuy").trimmed_mean
 
     def get_avg_maxsell(self):
         """Calculates average max sell of an item"""
-        return self.safe_average(self._maxSell)
+        return self.summary("_maxSell").trimmed_mean
 
     def get_buy_med(self):
         """Calculates the median buy of items."""
-        flat_list = self.flatten_and_check(self._buy)
-        return statistics.median(flat_list) if flat_list else 0.0
+        return self.summary("_buy").median
 
     def get_sell_med(self):
         """Get sell median of an item"""
-        flat_list = self.flatten_and_check(self._sell)
-        return statistics.median(flat_list) if flat_list else 0.0
+        return self.summary("_sell").median
 
     def get_vwap_buy(self):
         """Volume-weighted average buy price."""
-        return self.volume_weighted_avg(self._buy, self._buyvolume)
+        summary = self.summary("_buy")
+        return summary.vwap if summary.vwap is not None else summary.trimmed_mean
 
     def get_vwap_sell(self):
         """Volume-weighted average sell price."""
-        return self.volume_weighted_avg(self._sell, self._sellvolume)
+        summary = self.summary("_sell")
+        return summary.vwap if summary.vwap is not None else summary.trimmed_mean
 
 
 class TradingAlgo:
@@ -226,6 +273,10 @@ class Main:
     def metrics(self, search):
         """Determines if it's worth buying."""
         item_result = self.search_function.search_item(search)
+        return self.build_metrics(item_result, search)
+
+    def build_metrics(self, item_result, search):
+        """Turns the day/hour/week api results into the metrics dict"""
         if not item_result:
             print("Item not found!")
             return False
@@ -246,6 +297,10 @@ class Main:
             item_result[2].get_sell_vol(), item_result[2].get_buy_vol()
         )
 
+        return self.metrics_from_items(item_day, item_hour, item_week, search)
+
+    def metrics_from_items(self, item_day, item_hour, item_week, search):
+        """The metrics dict from the three Items, anything with Item's summaries works"""
         searched_item = TradingAlgo(item_day, item_hour, item_week)
 
         profitability = ((searched_item.weighted_sell() - searched_item.weighted_buy()) /
@@ -301,7 +356,52 @@ class Main:
         return metrics
 
     def main_algo(self, search):
-        metrics = self.metrics(search)
+        return self.score(self.metrics(search))
+
+    async def main_algo_async(self, search, client=None, scoring=None, store=None):
+        """Same as main_algo but nothing blocks the event loop, the scoring runs on scoring (a ScoringExecutor).
+
+        With a HistoryStore the history comes from it, so mostly only the hour call goes out,
+        and if it keeps OnlineMetrics the metrics come from those.
+        """
+        if store is not None:
+            item_result = await self.search_function.search_item_stored(search, store, client)
+            online = store.online_metrics(self.search_function.product_id(search))
+            if online is not None and item_result and None not in item_result:
+                # the running windows already took the new samples, nothing to rescan or offload
+                return self.score(self.metrics_from_items(*online.items(), search))
+            if scoring is None:
+                return self.score_result(item_result, search)
+            return await scoring.run(score_item_result, item_result, search)
+
+        if scoring is None:
+            item_result = await self.search_function.search_item_async(search, client)
+            return self.score_result(item_result, search)
+
+        # json parsing is CPU work too, so the raw bodies go to the executor along with the scoring
+        raw_result = await self.search_function.search_item_async(search, client, parse=False)
+        return await scoring.run(score_raw_result, raw_result, search)
+
+    async def fetch_history_async(self, search, client=None, store=None):
+        """What main_algo_async would score, for ScoringExecutor.score_batch.
+
+        The (day, hour, week) Items with a HistoryStore (score_batch's parsed), the raw api
+        bodies without one so the parsing happens in the scoring workers too.
+        """
+        if store is not None:
+            return await self.search_function.search_item_stored(search, store, client)
+        return await self.search_function.search_item_async(search, client, parse=False)
+
+    def score_raw(self, raw_result, search):
+        """Parses raw api bodies and scores them"""
+        return self.score_result(self.search_function.parse_results(raw_result), search)
+
+    def score_result(self, item_result, search):
+        """build_metrics + score in one call, so it can be handed to an executor"""
+        return self.score(self.build_metrics(item_result, search))
+
+    def score(self, metrics):
+        """Scores a metrics dict and returns the signal"""
         if not metrics:
             print("Item not found!")
             return False
@@ -397,3 +497,13 @@ class Main:
 
         decision = "Buy" if total_points >= 10 else "Watch" if total_points >= 5 else "No"
         return {"Signal": decision, "metrics": metrics}
+
+
+def score_raw_result(raw_result, search):
+    """Top level so executors (and worker processes) can run it: raw api bodies -> main_algo result"""
+    return Main().score_raw(raw_result, search)
+
+
+def score_item_result(item_result, search):
+    """Same for already parsed (day, hour, week) Items"""
+    return Main().score_result(item_result, search)
@@ -1,86 +1,148 @@
+import asyncio
+import json
+import warnings
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
 import requests
 
+import config
+from time_index import TimeIndex, time_order
+
+COFL_HISTORY_URL = "https://sky.coflnet.com/api/bazaar/{item}/history/{horizon}"
+HORIZONS = ("week", "hour", "day")  # upstream calls needed per item
+FIELDS = ("maxSell", "maxBuy", "minBuy", "minSell", "buy", "sell", "sellVolume", "buyVolume")  # Item's rows
+
+
+def to_number(value):
+    """float(value), NaN for values coflnet left out and 0.0 for ones that aren't numbers"""
+    if value is None:
+        return np.nan
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def to_timestamps(stamps):
+    """Coflnet's ISO 8601 UTC times as epoch seconds, NaN for missing or unreadable ones"""
+    stamps = [stamp[:-1] if isinstance(stamp, str) and stamp.endswith("Z") else stamp for stamp in stamps]
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")  # numpy only warns about utc offsets, those go the slow way
+            times = np.array(stamps, dtype="datetime64[ms]")
+    except (ValueError, TypeError, Warning):
+        return np.array([to_epoch(stamp) for stamp in stamps], dtype=np.float64)
+    seconds = times.astype(np.int64) / 1000.0
+    seconds[np.isnat(times)] = np.nan
+    return seconds
+
+
+def to_epoch(stamp):
+    """One timestamp for to_timestamps' slow path"""
+    try:
+        parsed = datetime.fromisoformat(stamp)
+    except (ValueError, TypeError):
+        return np.nan
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
 
 class Item:
     """Item class derived from the api.
 
-    The lists here will be populated with the items stats.
+    Every stat is a contiguous float64 array (NaN where coflnet left the value out), with
+    the sample times next to them as epoch seconds. from_records fills them in one pass.
+    Samples are kept oldest first so time ranges are found by binary search.
 
     """
 
-    def __init__(self): # this just holds all values the COFLAPI returns
-        self._maxSell = []
-        self._maxBuy = []
-        self._min_buy = []
-        self._minSell = []
-        self._buy = []
-        self._sell = []
-        self._sellvolume = []
-        self._buyvolume = []
-
-    def set_max_sell(self, data):
-        """Adds to max sell."""
-        self._maxSell.append(data)
+    def __init__(self, columns=None, timestamps=None): # this just holds all values the COFLAPI returns
+        columns = np.empty((len(FIELDS), 0)) if columns is None else columns  # one row per field
+        timestamps = np.full(columns.shape[1], np.nan) if timestamps is None else timestamps
+        order = time_order(timestamps)
+        if order is not None:
+            columns, timestamps = np.ascontiguousarray(columns[:, order]), timestamps[order]
+        self._columns = columns
+        self._timestamps = timestamps
+        self._index = TimeIndex(timestamps)
+
+    @classmethod
+    def from_records(cls, api_data):
+        """Builds the arrays from coflnet's list of history dicts"""
+        records = [[data.get(field) for field in FIELDS] for data in api_data]
+        stamps = [data.get("timestamp") for data in api_data]
+        try:
+            values = np.array(records, dtype=np.float64)  # None becomes NaN here
+        except (ValueError, TypeError):
+            values = np.array([[to_number(value) for value in record] for record in records], dtype=np.float64)
+        columns = np.ascontiguousarray(values.reshape(-1, len(FIELDS)).T)
+        return cls(columns, to_timestamps(stamps))
+
+    def __len__(self):
+        return self._columns.shape[1]
 
     def get_max_sell(self):
-        """Returns list of max sell"""
-        return self._maxSell
-
-    def set_max_buy(self, data):
-        """Set max buy from the data"""
-        self._maxBuy.append(data)
+        """Returns max sell"""
+        return self._columns[0]
 
     def get_max_buy(self):
         """Return max buy"""
-        return self._maxBuy
-
-    def set_min_buy(self, data):
-        """Add to min buy"""
-        self._min_buy.append(data)
+        return self._columns[1]
 
     def get_min_buy(self):
         """Return min buy"""
-        return self._min_buy
-
-    def set_min_sell(self, data):
-        """Add to min sell"""
-        self._minSell.append(data)
+        return self._columns[2]
 
     def get_min_sell(self):
         """Return min sell"""
-        return self._minSell
-
-    def set_buy(self, data):
-        """curr buy price"""
-        self._buy.append(data)
+        return self._columns[3]
 
     def get_buy(self):
         """Return buy"""
-        return self._buy
-
-    def set_sell(self, data):
-        """Set sell from api result"""
-        self._sell.append(data)
+        return self._columns[4]
 
     def get_sell(self):
         """Return the sell item"""
-        return self._sell
-
-    def set_sell_vol(self, data):
-        """Set the sell vol from api"""
-        self._sellvolume.append(data)
+        return self._columns[5]
 
     def get_sell_vol(self):
         """Get sell vol from the itemclass"""
-        return self._sellvolume
-
-    def set_buy_vol(self, data):
-        """Set the buy volume from api"""
-        self._buyvolume.append(data)
+        return self._columns[6]
 
     def get_buy_vol(self):
         """Get buy volume"""
-        return self._buyvolume
+        return self._columns[7]
+
+    def get_columns(self):
+        """All stats as one (fields x samples) array, rows in FIELDS order"""
+        return self._columns
+
+    def get_timestamps(self):
+        """Sample times as epoch seconds, oldest first, NaN (at the end) where coflnet sent none"""
+        return self._timestamps
+
+    def time_index(self):
+        """The TimeIndex over the sample times"""
+        return self._index
+
+    def window(self, span):
+        """Item over a slice of the samples, the arrays are views so nothing is copied"""
+        return Item(self._columns[:, span], self._timestamps[span])
+
+    def between(self, start=None, end=None):
+        """Samples with start <= time < end (epoch seconds)"""
+        return self.window(self._index.span(start, end))
+
+    def last(self, seconds, now=None):
+        """The trailing window, e.g. last(6 * HOUR), up to the newest sample unless now is given"""
+        return self.window(self._index.trailing(seconds, now))
+
+    def nbytes(self):
+        """Memory held by the arrays"""
+        return self._columns.nbytes + self._timestamps.nbytes
 
 
 class Api:
@@ -98,122 +160,84 @@ class Api:
         """Sets item_name to searched item"""
         self._item_name = item
 
-    def call_api_week(self):
-        """This calls the api for weekly """
-        api_item = self.get_api_item()
-        api_response = requests.get(f"https://sky.coflnet.com/api/bazaar/{api_item}/history/week")
+    def history_url(self, horizon):
+        """Builds the coflnet history url for hour/day/week"""
+        return COFL_HISTORY_URL.format(item=self.get_api_item(), horizon=horizon)
 
-        if api_response.status_code == 400:
+    def check_status(self, status_code):
+        """Prints what went wrong with the api, returns True if the response is usable"""
+        if status_code == 400:
             print("Bad Request. Api Linked most likely changed.")
-            return
+            return False
 
-        if api_response.status_code == 500:
+        if status_code == 500:
             print("Server side problem. CoflSky Api is most likely down.")
-            return
+            return False
 
-        if api_response.status_code == 503:
+        if status_code == 503:
             print("CoflSky Api is down! Try again later.")
-            return
+            return False
 
-        if api_response.status_code == 404:
+        if status_code == 404:
             print("Website link changed, please notify the developer so they can update it!")
-            return
-
-        if api_response.status_code == 200:
-            api_data = api_response.json()
-            current_item = Item()
-            for data in api_data:
-                try:
-                    current_item.set_max_buy(data.get("maxBuy", []))
-                    current_item.set_min_buy(data.get("minBuy", []))
-                    current_item.set_max_sell(data.get("maxSell", []))
-                    current_item.set_min_sell(data.get("minSell", []))
-                    current_item.set_buy(data.get("buy", []))
-                    current_item.set_sell(data.get("sell", []))
-                    current_item.set_sell_vol(data.get("sellVolume", []))
-                    current_item.set_buy_vol(data.get("buyVolume", []))
-                except KeyError:
-                    pass
-
-            return current_item
-
-    def call_api_hourly(self):
-        """Calls the api """
-        api_item = self.get_api_item()
-        api_response = requests.get(f"https://sky.coflnet.com/api/bazaar/{api_item}/history/hour")
-
-        if api_response.status_code == 400:
-            print("Bad Request. Api Linked most likely changed.")
-            return
+            return False
 
-        if api_response.status_code == 500:
-            print("Server side problem. CoflSky Api is most likely down.")
-            return
+        return status_code == 200
 
-        if api_response.status_code == 503:
-            print("CoflSky Api is down! Try again later.")
-            return
+    def parse_history(self, api_data):
+        """Turns the json history list into an Item"""
+        return Item.from_records(api_data)
 
-        if api_response.status_code == 404:
-            print("Website link changed, please notify the developer so they can update it!")
-            return
+    def call_api_week(self):
+        """This calls the api for weekly """
+        api_response = requests.get(self.history_url("week"))
+        if self.check_status(api_response.status_code):
+            return self.parse_history(api_response.json())
 
-        if api_response.status_code == 200:
-            api_data = api_response.json()
-            current_item = Item()
-            for data in api_data:
-                try:
-                    current_item.set_max_buy(data.get("maxBuy", []))
-                    current_item.set_min_buy(data.get("minBuy", []))
-                    current_item.set_max_sell(data.get("maxSell", []))
-                    current_item.set_min_sell(data.get("minSell", []))
-                    current_item.set_buy(data.get("buy", []))
-                    current_item.set_sell(data.get("sell", []))
-                    current_item.set_sell_vol(data.get("sellVolume", []))
-                    current_item.set_buy_vol(data.get("buyVolume", []))
-                except KeyError:
-                    pass
-
-            return current_item
+    def call_api_hourly(self):
+        """Calls the api """
+        api_response = requests.get(self.history_url("hour"))
+        if self.check_status(api_response.status_code):
+            return self.parse_history(api_response.json())
 
     def call_api_day(self):
         """Calls the api with different status codes """
-        api_item = self.get_api_item()
-        api_response = requests.get(f"https://sky.coflnet.com/api/bazaar/{api_item}/history/day")
-
-        if api_response.status_code == 400:
-            print("Bad Request. Api Linked most likely changed.")
-            return
-
-        if api_response.status_code == 500:
-            print("Server side problem. CoflSky Api is most likely down.")
-            return
-
-        if api_response.status_code == 503:
-            print("CoflSky Api is down! Try again later.")
-            return
-
-        if api_response.status_code == 404:
-            print("Website link changed, please notify the developer so they can update it!")
-            return
-
-        if api_response.status_code == 200:
-            api_data = api_response.json()
-            current_item = Item()
-            for data in api_data:
-                try:
-                    current_item.set_max_buy(data.get("maxBuy", []))
-                    current_item.set_min_buy(data.get("minBuy", []))
-                    current_item.set_max_sell(data.get("maxSell", []))
-                    current_item.set_min_sell(data.get("minSell", []))
-                    current_item.set_buy(data.get("buy", []))
-                    current_item.set_sell(data.get("sell", []))
-                    current_item.set_sell_vol(data.get("sellVolume", []))
-                    current_item.set_buy_vol(data.get("buyVolume", []))
-                except KeyError:
-                    pass
-
-            return current_item
+        api_response = requests.get(self.history_url("day"))
+        if self.check_status(api_response.status_code):
+            return self.parse_history(api_response.json())
+
+    async def call_api_async(self, client, horizon, parse=True):
+        """Async version of the call_api_* methods for a single horizon, parse=False returns the raw body"""
+        api_response = await client.get(self.history_url(horizon))
+        if self.check_status(api_response.status_code):
+            if not parse:
+                return api_response.content
+            return self.parse_history(api_response.json())
+
+    def parse_raw(self, content):
+        """Parses a raw body from call_api_async(parse=False), None stays None"""
+        if content is None:
+            return None
+        return self.parse_history(json.loads(content))
+
+    def parse_results(self, raw_result):
+        """Parses call_api_all(parse=False)'s day/hour/week bodies"""
+        return tuple(self.parse_raw(content) for content in raw_result)
+
+    async def call_api_all(self, client=None, parse=True):
+        """Requests week/hour/day at the same time, returns them as day, hour, week"""
+        own_client = client is None
+        if own_client:
+            client = httpx.AsyncClient()
+        try:
+            item_data_week, item_data_hour, item_data_day = await asyncio.gather(
+                *(self.call_api_async(client, horizon, parse) for horizon in HORIZONS)
+            )
+        finally:
+            if own_client:
+                await client.aclose()
+
+        return item_data_day, item_data_hour, item_data_week
 
 
 class Search:
@@ -222,15 +246,20 @@ class Search:
         from search_func import Search_Fun
         self._search_function = Search_Fun()
         self._api = Api()
+        if config.SINGLE_CALL_MODE:
+            from single_call import SingleCallApi
+            self._api = SingleCallApi()  # one upstream request per item, views derived locally
+
+    def product_id(self, arg):
+        """Returns the coflnet product id of a search, None if it isn't a bazaar item"""
+        return self._search_function.product_id(arg)
 
     def search_item(self, arg):
         """Searches something returns by day/hour/week"""
-        x = self._search_function.search_item(arg)
-        from items_list import baz_items
-        if x is False:
+        dict_item = self.product_id(arg)
+        if dict_item is None:
             return
         else:
-            dict_item = baz_items[arg]
             self._api.set_api_item(dict_item)
             item_data_week = self._api.call_api_week()
             item_data_hour = self._api.call_api_hourly()
@@ -239,4 +268,25 @@ class Search:
             data_to_process = item_data_day, item_data_hour, item_data_week
             return data_to_process
 
+    async def search_item_async(self, arg, client=None, parse=True):
+        """Same as search_item but all three horizons are fetched concurrently"""
+        dict_item = self.product_id(arg)
+        if dict_item is None:
+            return
+        else:
+            self._api.set_api_item(dict_item)
+            return await self._api.call_api_all(client, parse)
 
+    async def search_item_stored(self, arg, store, client=None):
+        """search_item_async through a HistoryStore, mostly only the hour history gets downloaded"""
+        dict_item = self.product_id(arg)
+        if dict_item is None:
+            return
+        self._api.set_api_item(dict_item)
+        return await store.fetch(self._api, client)
+
+    def parse_results(self, raw_result):
+        """Parses the raw day/hour/week bodies from search_item_async(parse=False)"""
+        if raw_result is None:
+            return None
+        return self._api.parse_results(raw_result)
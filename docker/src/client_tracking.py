@@ -0,0 +1,168 @@
+import asyncio
+
+from redis.asyncio import ConnectionPool
+from redis.exceptions import ConnectionError
+
+import config
+from local_cache import LocalCache
+
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+
+
+class TrackingCache:
+    """Local copies of redis values that redis itself keeps consistent.
+
+    Reads go over one connection with CLIENT TRACKING ON, redirected to a second
+    connection subscribed to __redis__:invalidate (RESP2 redirect mode, redis 6+).
+    Redis remembers every key the reader fetched and pushes an invalidation the moment
+    anyone writes it, so repeat reads of hot keys are answered from memory and go
+    back to redis right after another worker writes a new value.
+
+    """
+
+    def __init__(self, url=None, max_size=None):
+        self._pool = ConnectionPool.from_url(url or config.REDIS_URL)
+        self._local = LocalCache(max_size)
+        self._reader = None
+        self._listener = None
+        self._read_lock = asyncio.Lock()
+        self._fetching = {}  # key -> invalidated while the GET was in flight
+        self._task = None
+        self._invalidation_messages = 0
+        self._flushes = 0
+        self._reconnects = 0
+
+    async def connect(self):
+        """Opens the listener and reader connections and turns tracking on"""
+        listener = self._pool.make_connection()
+        await listener.connect()
+        await listener.send_command("CLIENT", "ID")
+        listener_id = await listener.read_response()
+        await listener.send_command("SUBSCRIBE", INVALIDATE_CHANNEL)
+        await listener.read_response()  # subscribe confirmation
+
+        reader = self._pool.make_connection()
+        await reader.connect()
+        await reader.send_command("CLIENT", "TRACKING", "ON", "REDIRECT", listener_id)
+        await reader.read_response()  # raises on redis < 6
+
+        self._listener, self._reader = listener, reader
+        self._local.clear()  # nothing we cached before is tracked by the new connections
+
+    async def close(self):
+        """Closes both connections"""
+        for conn in (self._reader, self._listener):
+            if conn is not None:
+                await conn.disconnect()
+        self._reader = self._listener = None
+        self._local.clear()
+
+    def invalidate(self, keys):
+        """Handles one invalidation push, None means redis flushed everything"""
+        self._invalidation_messages += 1
+        if keys is None:
+            self._flushes += 1
+            self._local.clear()
+            for key in self._fetching:
+                self._fetching[key] = True
+            return
+        for key in keys:
+            key = key.decode() if isinstance(key, bytes) else key
+            self._local.invalidate(key)
+            if key in self._fetching:
+                self._fetching[key] = True
+
+    async def listen(self):
+        """Reads invalidation pushes until cancelled, reconnects if redis goes away"""
+        while True:
+            try:
+                if self._listener is None:
+                    await self.connect()
+                message = await self._listener.read_response()
+                if isinstance(message, list) and len(message) == 3 and message[0] in (b"message", "message"):
+                    self.invalidate(message[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Client tracking lost redis: {e}")
+                self._reconnects += 1
+                await self.close()
+                await asyncio.sleep(1)
+
+    async def get(self, key):
+        """Value for key, from memory when redis hasn't told us it changed"""
+        raw = self._local.get(key)
+        if raw is not None:
+            return raw
+
+        async with self._read_lock:  # one tracked connection, one command at a time
+            if self._reader is None:
+                raise ConnectionError("client tracking is reconnecting")
+            self._fetching[key] = False
+            try:
+                await self._reader.send_command("GET", key)
+                raw = await self._reader.read_response()
+            except Exception:
+                await self.close()  # tracking state is unknown now, the listener reconnects
+                raise
+            finally:
+                invalidated = self._fetching.pop(key, True)
+
+        if raw is not None and not invalidated:  # changed while we read it, don't keep the old value
+            self._local.set(key, raw)
+        return raw
+
+    async def get_many(self, keys):
+        """Values for keys in order, whatever isn't in memory comes back in one tracked MGET"""
+        values = [self._local.get(key) for key in keys]
+        missing = [key for key, raw in zip(keys, values) if raw is None]
+        if not missing:
+            return values
+
+        async with self._read_lock:
+            if self._reader is None:
+                raise ConnectionError("client tracking is reconnecting")
+            for key in missing:
+                self._fetching[key] = False
+            try:
+                await self._reader.send_command("MGET", *missing)
+                fetched = await self._reader.read_response()
+            except Exception:
+                await self.close()
+                raise
+            finally:
+                invalidated = {key: self._fetching.pop(key, True) for key in missing}
+
+        fetched = dict(zip(missing, fetched))
+        for key, raw in fetched.items():
+            if raw is not None and not invalidated[key]:
+                self._local.set(key, raw)
+        return [fetched[key] if raw is None else raw for key, raw in zip(keys, values)]
+
+    async def start(self):
+        """Connects (raises if the server can't track) and starts the listener"""
+        await self.connect()
+        self._task = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        """Stops listening and closes the connections"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.close()
+        await self._pool.disconnect()
+
+    def stats(self):
+        """Tracking counters for /stats"""
+        local = self._local.stats()
+        return {
+            "connected": self._reader is not None,
+            "size": local["size"],
+            "hits": local["hits"],
+            "misses": local["misses"],
+            "evictions": local["evictions"],
+            "invalidations": local["invalidations"],
+            "invalidation_messages": self._invalidation_messages,
+            "flushes": self._flushes,
+            "reconnects": self._reconnects,
+        }
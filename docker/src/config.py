@@ -0,0 +1,121 @@
+import os
+
+# Tunables for the api. Everything can be overridden with env vars (docker-compose environment:)
+
+
+def env_int(name, default):
+    """Reads an int env var"""
+    return int(os.getenv(name, default))
+
+
+def env_float(name, default):
+    """Reads a float env var"""
+    return float(os.getenv(name, default))
+
+
+def env_bool(name, default):
+    """Reads a bool env var, 1/true/yes/on count as True"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Coflnet http client pool
+COFL_MAX_CONNECTIONS = env_int("COFL_MAX_CONNECTIONS", 20)  # hard cap of open sockets to coflnet
+COFL_MAX_KEEPALIVE = env_int("COFL_MAX_KEEPALIVE", 10)  # idle sockets we keep around for reuse
+COFL_KEEPALIVE_EXPIRY = env_float("COFL_KEEPALIVE_EXPIRY", 30.0)  # seconds an idle socket is kept
+COFL_HTTP2 = env_bool("COFL_HTTP2", False)  # multiplex requests over one connection, needs h2
+COFL_CONNECT_TIMEOUT = env_float("COFL_CONNECT_TIMEOUT", 3.0)
+COFL_READ_TIMEOUT = env_float("COFL_READ_TIMEOUT", 10.0)
+COFL_POOL_TIMEOUT = env_float("COFL_POOL_TIMEOUT", 5.0)  # how long to wait for a free connection
+
+# Redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis")
+
+# Cross worker refresh lock, only the holder recomputes a product
+REFRESH_LOCK_LEASE_MS = env_int("REFRESH_LOCK_LEASE_MS", 15000)  # lock auto expires if the holder dies
+REFRESH_LOCK_WAIT_MS = env_int("REFRESH_LOCK_WAIT_MS", 3000)  # how long others wait for the fresh value
+REFRESH_LOCK_POLL_MS = env_int("REFRESH_LOCK_POLL_MS", 50)
+
+# Signal cache (stale-while-revalidate). Fresh until the soft ttl, then served stale while it
+# refreshes in the background, gone after the hard ttl
+SIGNAL_SOFT_TTL = env_int("SIGNAL_SOFT_TTL", 3600)
+SIGNAL_HARD_TTL = env_int("SIGNAL_HARD_TTL", 4 * 3600)
+
+# Background prefetch of every bazaar item so /items/ is mostly a cache read. Every worker
+# process runs its own prefetcher with its own token bucket, so the budget is per worker: with
+# uvicorn --workers N coflnet sees up to N x PREFETCH_BUDGET_PER_MINUTE, divide it by N.
+PREFETCH_ENABLED = env_bool("PREFETCH_ENABLED", True)
+PREFETCH_BUDGET_PER_MINUTE = env_int("PREFETCH_BUDGET_PER_MINUTE", 120)  # upstream requests one worker's prefetcher may spend
+PREFETCH_CONCURRENCY = env_int("PREFETCH_CONCURRENCY", 4)  # batches refreshed at the same time
+PREFETCH_BATCH_SIZE = env_int("PREFETCH_BATCH_SIZE", 16)  # due products fetched together and scored in one score_batch
+PREFETCH_LEAD_SECONDS = env_int("PREFETCH_LEAD_SECONDS", 300)  # refresh this long before an entry goes stale
+PREFETCH_IDLE_SLEEP = env_float("PREFETCH_IDLE_SLEEP", 5.0)  # longest nap when nothing is due
+
+# Refresh queue priorities. Hot and volatile products get refreshed close to the min interval,
+# dead ones close to the max
+REFRESH_MIN_INTERVAL = env_int("REFRESH_MIN_INTERVAL", 300)
+REFRESH_MAX_INTERVAL = env_int("REFRESH_MAX_INTERVAL", 3 * 3600)
+REFRESH_HIT_HALF_LIFE = env_float("REFRESH_HIT_HALF_LIFE", 3600.0)  # seconds until a /items/ hit counts half
+REFRESH_POPULARITY_WEIGHT = env_float("REFRESH_POPULARITY_WEIGHT", 1.0)
+REFRESH_VOLATILITY_WEIGHT = env_float("REFRESH_VOLATILITY_WEIGHT", 0.1)  # per % of volatility
+
+# Adaptive soft ttl, calm illiquid items stay cached up to the max, fast movers go down to the min
+SIGNAL_MIN_TTL = env_int("SIGNAL_MIN_TTL", 300)
+SIGNAL_MAX_TTL = env_int("SIGNAL_MAX_TTL", 3 * 3600)
+TTL_VOLATILITY_WEIGHT = env_float("TTL_VOLATILITY_WEIGHT", 0.25)  # per % of volatility
+TTL_MOMENTUM_WEIGHT = env_float("TTL_MOMENTUM_WEIGHT", 0.5)  # per % of price momentum
+TTL_VOLUME_WEIGHT = env_float("TTL_VOLUME_WEIGHT", 0.25)  # per log of relative volume
+
+# Spreading expiries out so keys written together don't all recompute together
+SIGNAL_TTL_JITTER = env_float("SIGNAL_TTL_JITTER", 0.1)  # ttl is randomly stretched/shrunk by up to this fraction
+XFETCH_BETA = env_float("XFETCH_BETA", 1.0)  # >1 refreshes earlier, 0 turns probabilistic early refresh off
+
+# In process cache in front of redis, invalidated over pub/sub when any worker writes a product
+LOCAL_CACHE_SIZE = env_int("LOCAL_CACHE_SIZE", 2048)  # entries per worker, 0 turns it off
+LOCAL_CACHE_TTL = env_float("LOCAL_CACHE_TTL", 60.0)  # safety net in case an invalidation is missed
+SIGNAL_INVALIDATE_CHANNEL = os.getenv("SIGNAL_INVALIDATE_CHANNEL", "signal:invalidate")
+
+# Redis server assisted client side caching (CLIENT TRACKING, redis 6+). When it works it replaces the
+# pub/sub invalidation above, redis itself tells us which keys we read have changed
+REDIS_CLIENT_TRACKING = env_bool("REDIS_CLIENT_TRACKING", True)
+
+# Shared redis pool, created once at startup
+REDIS_MAX_CONNECTIONS = env_int("REDIS_MAX_CONNECTIONS", 50)
+REDIS_POOL_TIMEOUT = env_float("REDIS_POOL_TIMEOUT", 5.0)  # how long a request waits for a free connection
+REDIS_HEALTH_INTERVAL = env_float("REDIS_HEALTH_INTERVAL", 15.0)  # seconds between background pings
+
+# Scoring runs off the event loop on a bounded pool
+SCORING_BACKEND = os.getenv("SCORING_BACKEND", "process")  # "process" or "thread"
+SCORING_PROCESSES = env_int("SCORING_PROCESSES", 0)  # 0 means one per core
+SCORING_THREADS = env_int("SCORING_THREADS", 1)  # pure python, more threads mostly fight the event loop for the GIL
+SCORING_CHUNK_SIZE = env_int("SCORING_CHUNK_SIZE", 16)  # items per task when scoring a batch
+SCORING_MAX_PENDING = env_int("SCORING_MAX_PENDING", 64)  # jobs queued or running before callers wait
+LOOP_LAG_INTERVAL = env_float("LOOP_LAG_INTERVAL", 0.1)  # how often the event loop lag is sampled
+
+# Per worker coflnet history, refreshes then only download the hour history
+HISTORY_STORE_ENABLED = env_bool("HISTORY_STORE_ENABLED", True)
+HISTORY_STORE_SIZE = env_int("HISTORY_STORE_SIZE", 1024)  # products kept per worker
+HISTORY_RESEED_INTERVAL = env_int("HISTORY_RESEED_INTERVAL", 21600)  # full re-download after this, bounds drift
+ONLINE_METRICS = env_bool("ONLINE_METRICS", False)  # running windows per stored product, refreshes skip the rescan (~100KB each)
+
+# Per hour mergeable summaries of every stored product, GET /items/window merges them for any span
+HOURLY_SUMMARIES = env_bool("HOURLY_SUMMARIES", False)
+HOURLY_RETENTION = env_int("HOURLY_RETENTION", 24 * 28)  # hours kept per product, windows can't reach further
+# An hour's summary is ~2.5KB, so a product at full retention is ~1.7MB. They get their own LRU,
+# far smaller than HISTORY_STORE_SIZE: 32 products is ~55MB per worker, 1024 would be ~1.7GB
+HOURLY_SUMMARIES_SIZE = env_int("HOURLY_SUMMARIES_SIZE", 32)  # products with hourly summaries per worker
+SKETCH_COMPRESSION = env_int("SKETCH_COMPRESSION", 25)  # t-digest size of one hour, bigger is more accurate
+WINDOW_SKETCH_COMPRESSION = env_int("WINDOW_SKETCH_COMPRESSION", 100)  # t-digest size when hours are merged for a window
+
+# One coflnet request per item, the hour/day/week views get resampled from it (check with single_call.py first)
+SINGLE_CALL_MODE = env_bool("SINGLE_CALL_MODE", False)
+SINGLE_CALL_URL = os.getenv("SINGLE_CALL_URL", "https://sky.coflnet.com/api/bazaar/{item}/history?start={start}&end={end}")
+SINGLE_CALL_HOUR_STEP = env_int("SINGLE_CALL_HOUR_STEP", 60)  # seconds per sample of each view
+SINGLE_CALL_DAY_STEP = env_int("SINGLE_CALL_DAY_STEP", 300)
+SINGLE_CALL_WEEK_STEP = env_int("SINGLE_CALL_WEEK_STEP", 7200)
+
+# POST /items/batch
+BATCH_MAX_ITEMS = env_int("BATCH_MAX_ITEMS", 500)  # search terms accepted per request
+BATCH_CONCURRENCY = env_int("BATCH_CONCURRENCY", 8)  # cache misses computed at once per request
@@ -0,0 +1,105 @@
+import httpx
+
+import config
+
+
+def http2_available():
+    """HTTP/2 in httpx needs the h2 package"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class CoflClient:
+    """Shared http client for coflnet.
+
+    One of these lives on the app for its whole lifetime so requests reuse
+    the same keep-alive connections instead of doing a new TCP+TLS handshake every call.
+
+    """
+
+    def __init__(self, max_connections=None, max_keepalive=None, keepalive_expiry=None, http2=None,
+                 connect_timeout=None, read_timeout=None, pool_timeout=None):
+        self._max_connections = max_connections or config.COFL_MAX_CONNECTIONS
+        self._max_keepalive = max_keepalive or config.COFL_MAX_KEEPALIVE
+        self._connect_timeout = connect_timeout or config.COFL_CONNECT_TIMEOUT
+        self._read_timeout = read_timeout or config.COFL_READ_TIMEOUT
+        self._pool_timeout = pool_timeout or config.COFL_POOL_TIMEOUT
+
+        self._http2 = config.COFL_HTTP2 if http2 is None else http2
+        if self._http2 and not http2_available():
+            print("h2 is not installed, coflnet client falls back to HTTP/1.1")
+            self._http2 = False
+
+        limits = httpx.Limits(
+            max_connections=self._max_connections,
+            max_keepalive_connections=self._max_keepalive,
+            keepalive_expiry=keepalive_expiry or config.COFL_KEEPALIVE_EXPIRY,
+        )
+        self._client = httpx.AsyncClient(limits=limits, timeout=self.make_timeout(), http2=self._http2)
+
+        # counters for /stats
+        self._requests = 0
+        self._errors = 0
+        self._pool_timeouts = 0
+        self._in_flight = 0
+        self._peak_in_flight = 0
+
+    def make_timeout(self, connect_timeout=None, read_timeout=None):
+        """Builds a httpx timeout, anything not passed uses the client defaults"""
+        read = read_timeout or self._read_timeout
+        return httpx.Timeout(
+            connect=connect_timeout or self._connect_timeout,
+            read=read,
+            write=read,
+            pool=self._pool_timeout,
+        )
+
+    async def get(self, url, connect_timeout=None, read_timeout=None):
+        """GET through the shared pool, timeouts can be changed per call"""
+        timeout = self.make_timeout(connect_timeout, read_timeout)
+        self._requests += 1
+        self._in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            return await self._client.get(url, timeout=timeout)
+        except httpx.PoolTimeout:
+            self._pool_timeouts += 1
+            self._errors += 1
+            raise
+        except httpx.HTTPError:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def pool_connections(self):
+        """Connections currently held by the transport, empty if httpx hides them"""
+        transport = getattr(self._client, "_transport", None)
+        pool = getattr(transport, "_pool", None)
+        return list(getattr(pool, "connections", []))
+
+    def stats(self):
+        """Pool utilisation numbers, used to size the limits"""
+        connections = self.pool_connections()
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "http2": self._http2,
+            "max_connections": self._max_connections,
+            "max_keepalive": self._max_keepalive,
+            "open_connections": len(connections),
+            "active_connections": len(connections) - idle,
+            "idle_connections": idle,
+            "utilisation": (len(connections) - idle) / self._max_connections,
+            "in_flight": self._in_flight,
+            "peak_in_flight": self._peak_in_flight,
+            "requests": self._requests,
+            "errors": self._errors,
+            "pool_timeouts": self._pool_timeouts,
+        }
+
+    async def aclose(self):
+        """Closes every pooled connection"""
+        await self._client.aclose()
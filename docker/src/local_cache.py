@@ -0,0 +1,116 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+
+import config
+
+
+class LocalCache:
+    """Size bounded LRU of raw redis values inside one worker.
+
+    Entries also get a short ttl so a missed invalidation can't keep an old value around forever.
+
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self._max_size = config.LOCAL_CACHE_SIZE if max_size is None else max_size
+        self._ttl = ttl or config.LOCAL_CACHE_TTL
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        """Raw value for key or None, a hit moves it to the front"""
+        item = self._entries.get(key)
+        if item is None or time.monotonic() - item[1] > self._ttl:
+            if item is not None:
+                del self._entries[key]
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return item[0]
+
+    def set(self, key, raw):
+        """Stores a raw value, evicting the least recently used one when full"""
+        if self._max_size <= 0:
+            return
+        self._entries[key] = (raw, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def invalidate(self, key):
+        """Drops key, called when another worker wrote a new value"""
+        if self._entries.pop(key, None) is not None:
+            self._invalidations += 1
+
+    def clear(self):
+        """Drops everything, used when we might have missed invalidations"""
+        self._entries.clear()
+
+    def stats(self):
+        """LRU counters for /stats"""
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "invalidations": self._invalidations,
+        }
+
+
+class Invalidator:
+    """Tells the other workers over redis pub/sub which keys changed, and listens for theirs."""
+
+    def __init__(self, local_cache, channel=None):
+        self._local_cache = local_cache
+        self._channel = channel or config.SIGNAL_INVALIDATE_CHANNEL
+        self._worker_id = uuid.uuid4().hex  # so we don't drop the value we just wrote ourselves
+        self._task = None
+
+    async def publish(self, client, key):
+        """Announces that key was rewritten"""
+        await client.publish(self._channel, f"{self._worker_id} {key}")
+
+    def handle(self, message):
+        """Invalidates the local copy for a message from another worker"""
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode()
+        worker_id, _, key = data.partition(" ")
+        if worker_id != self._worker_id:
+            self._local_cache.invalidate(key)
+
+    async def listen(self, client):
+        """Subscribes and invalidates until cancelled, resubscribes if redis goes away"""
+        while True:
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(self._channel)
+                self._local_cache.clear()  # anything from before the (re)subscribe could be old
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.handle(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Invalidation listener lost redis: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def start(self, client):
+        """Runs listen as a background task"""
+        self._task = asyncio.create_task(self.listen(client))
+
+    async def stop(self):
+        """Stops listening"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
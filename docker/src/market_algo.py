@@ -0,0 +1,214 @@
+import numpy as np
+
+from Bazaar_Algo import Item
+
+# api_call.Item getter for each series, in Bazaar_Algo.Item argument order
+SERIES = (
+    ("max_sell", "get_max_sell"),
+    ("max_buy", "get_max_buy"),
+    ("min_buy", "get_min_buy"),
+    ("min_sell", "get_min_sell"),
+    ("buy", "get_buy"),
+    ("sell", "get_sell"),
+    ("sell_volume", "get_sell_vol"),
+    ("buy_volume", "get_buy_vol"),
+)
+
+# TradingAlgo's day/hour/week weights
+PRICE_WEIGHTS = (0.3, 0.5, 0.2)
+VOLUME_WEIGHTS = (0.35, 0.45, 0.2)
+
+_checker = Item(*([[]] * len(SERIES)))  # only for flatten_and_check, so values are cleaned the same way
+
+
+class MarketArrays:
+    """One horizon (day, hour or week) of many products as (products x samples) arrays.
+
+    Rows are zero padded at the end and counts holds how many values each row really has.
+    A row that had no usable values holds [1.0] like Item.flatten_and_check returns.
+
+    """
+
+    def __init__(self, histories):
+        self._histories = histories
+        rows = {name: [_checker.flatten_and_check(getattr(history, getter)()) for history in histories]
+                for name, getter in SERIES}
+        width = max((len(row) for series in rows.values() for row in series), default=1)
+        self._columns = np.arange(width)
+        self.series = {}
+        self.counts = {}
+        for name, series in rows.items():
+            values = np.zeros((len(histories), width))
+            for i, row in enumerate(series):
+                values[i, :len(row)] = row
+            self.series[name] = values
+            self.counts[name] = np.array([len(row) for row in series])
+        self._sorted = {}
+        self._means = {}
+
+    def sorted(self, name):
+        """Rows sorted ascending with the padding moved past the real values, cached"""
+        if name not in self._sorted:
+            padding = self._columns >= self.counts[name][:, None]
+            values = np.where(padding, np.inf, self.series[name])
+            values.sort(axis=1)
+            self._sorted[name] = values
+        return self._sorted[name]
+
+    def median(self, name):
+        """Item.get_*_med per product"""
+        values, counts = self.sorted(name), self.counts[name]
+        rows = np.arange(len(values))
+        return (values[rows, (counts - 1) // 2] + values[rows, counts // 2]) / 2
+
+    def mean(self, name):
+        """Item.get_avg_* (SeriesSummary.trimmed_mean) per product, rows with more than 5 values drop 5% off each end first, cached"""
+        if name not in self._means:
+            counts = self.counts[name]
+            trim = np.where(counts > 5, (counts * 0.05).astype(int), 0)
+            keep = (self._columns >= trim[:, None]) & (self._columns < (counts - trim)[:, None])
+            self._means[name] = np.where(keep, self.sorted(name), 0.0).sum(axis=1) / (counts - 2 * trim)
+        return self._means[name]
+
+    def vwap(self, price, volume):
+        """Item.get_vwap_* per product, falls back to the trimmed mean without volume"""
+        getters = dict(SERIES)
+        weighted, total_volume = np.zeros(len(self._histories)), np.zeros(len(self._histories))
+        for i, history in enumerate(self._histories):
+            # the rows above have the missing values dropped already, so pair from the history itself
+            prices, volumes = _checker.paired(getattr(history, getters[price])(), getattr(history, getters[volume])())
+            weighted[i] = np.dot(prices, volumes)
+            total_volume[i] = volumes.sum()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total_volume == 0, self.mean(price), weighted / total_volume)
+
+
+class MarketData:
+    """Day, hour and week arrays for the products that had results"""
+
+    def __init__(self, item_results):
+        self.day = MarketArrays([result[0] for result in item_results])
+        self.hour = MarketArrays([result[1] for result in item_results])
+        self.week = MarketArrays([result[2] for result in item_results])
+
+    def weighted(self, name, weights=PRICE_WEIGHTS):
+        """TradingAlgo.weighted_* for every product at once"""
+        day, hour, week = weights
+        return day * self.day.mean(name) + hour * self.hour.mean(name) + week * self.week.mean(name)
+
+
+def market_metrics(data):
+    """Main.build_metrics as array operations, one value per product for each metric"""
+    weighted_buy = data.weighted("buy")
+    weighted_sell = data.weighted("sell")
+    medium_sell = data.week.vwap("sell", "sell_volume")
+    medium_buy = data.week.vwap("buy", "buy_volume")
+    week_sell_median = data.week.median("sell")
+
+    profitability = ((weighted_sell - weighted_buy) / weighted_buy) * 100
+    volatility = ((data.weighted("max_sell") - data.weighted("max_buy")) / data.weighted("min_buy")) * 100
+    liquid = (weighted_buy + weighted_sell) / 2
+    current_price = (weighted_sell + weighted_buy) / 2
+    momentum = (current_price - week_sell_median) / week_sell_median
+
+    weighted_sell_volume = data.weighted("sell_volume", VOLUME_WEIGHTS)
+    weighted_buy_volume = data.weighted("buy_volume", VOLUME_WEIGHTS)
+    relative_volume = ((weighted_buy_volume + weighted_sell_volume) / 2) / week_sell_median
+
+    weekly_avg_price = (data.weighted("min_sell") + data.weighted("max_sell")) / 2
+    price_stability = ((current_price - weekly_avg_price) / weekly_avg_price) * 100
+
+    immediate_trade_cost = (data.hour.median("buy") + data.hour.median("sell")) / 2
+    daily_trade_value = (data.day.median("buy") + data.day.median("sell")) / 2
+    expected_future_trade_value = (data.week.median("buy") + week_sell_median) / 2
+    risk = np.where(np.isfinite(volatility), volatility, 0.0)  # TradingAlgo.calc_volatility, 0 when min buy is 0
+    volatile = risk > 10  # lean on the hourly data when the price moves a lot
+    weighted_trade_value = (immediate_trade_cost * np.where(volatile, 0.5, 0.4) +
+                            daily_trade_value * 0.3 +
+                            expected_future_trade_value * np.where(volatile, 0.2, 0.3))
+    risk_adjusted_profit = (expected_future_trade_value - weighted_trade_value) / (1 + risk / 100)
+
+    return {
+        "profitability": profitability,
+        "volatility": volatility,
+        "liquidity": liquid,
+        "price_momentum": momentum,
+        "relative_volume": relative_volume,
+        "spread": weighted_sell - weighted_buy,
+        "price_stability": price_stability,
+        "historical_buy_comparison": ((weighted_buy - medium_buy) / medium_buy) * 100,
+        "historical_sell_comparison": ((weighted_sell - medium_sell) / medium_sell) * 100,
+        "medium_sell": medium_sell,
+        "medium_buy": medium_buy,
+        "possible_profit": risk_adjusted_profit,
+        "current_price": current_price,
+        "instant_sell": data.day.mean("sell"),
+    }
+
+
+def market_points(m):
+    """Main.score's rules as array operations, returns the total points per product"""
+    current_price = np.where(m["current_price"] > 0, m["current_price"], 1.0)
+    relative_liquidity = m["liquidity"] / current_price
+    spread_ratio = np.abs(m["spread"]) / current_price
+    relative_possible_profit = (m["possible_profit"] / current_price) * 100
+    volatile = m["volatility"] < -2
+
+    points = (relative_possible_profit > 2) + (relative_possible_profit > 0).astype(int)
+    points += (m["profitability"] > -5) & ~volatile
+    points += m["volatility"] > -3
+    points += np.select([relative_liquidity > 10, relative_liquidity > 5], [2, 1], -1)
+    points += np.select([m["price_momentum"] > 0.05, m["price_momentum"] > 0], [2, 1], 0)
+    points += m["price_stability"] > 100
+    points += np.select([spread_ratio < 0.01, spread_ratio < 0.02], [2, 1], -1)
+    points += (m["historical_buy_comparison"] > m["historical_sell_comparison"]) & (m["price_momentum"] > 0)
+    points += m["relative_volume"] > 0.05
+    points += m["current_price"] <= m["medium_buy"]
+    points += m["current_price"] >= m["medium_sell"]
+    points += m["instant_sell"] >= current_price * 0.98
+    return points
+
+
+def signal_table(item_results):
+    """Scores a whole catalog at once.
+
+    item_results are (day, hour, week) api_call.Item tuples like Search.search_item returns.
+    Returns (metrics, points, valid) where metrics maps each metric to an array over the
+    products and valid is False where Main.build_metrics would have divided by zero.
+    """
+    data = MarketData(item_results)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics = market_metrics(data)
+    valid = np.logical_and.reduce([np.isfinite(values) for values in metrics.values()])
+    return metrics, market_points(metrics), valid
+
+
+def decision(points):
+    return "Buy" if points >= 10 else "Watch" if points >= 5 else "No"
+
+
+def score_results(item_results, searches):
+    """Main.score_result for many products, in order.
+
+    Gives the same dict as main_algo, False if the item wasn't found and a
+    ZeroDivisionError where the scalar path would have raised one.
+    """
+    results = [False] * len(item_results)
+    found = []
+    for i, item_result in enumerate(item_results):
+        if item_result and any(history is None for history in item_result):
+            results[i] = ValueError(f"coflnet returned no history for {searches[i]}")  # a horizon call failed
+        elif item_result:
+            found.append(i)
+    if not found:
+        return results
+
+    metrics, points, valid = signal_table([item_results[i] for i in found])
+    for row, i in enumerate(found):
+        if not valid[row]:
+            results[i] = ZeroDivisionError(f"metrics for {searches[i]} divide by zero")
+            continue
+        item_metrics = {name: float(values[row]) for name, values in metrics.items()}
+        item_metrics["search_query"] = searches[i]
+        results[i] = {"Signal": decision(points[row]), "metrics": item_metrics}
+    return results
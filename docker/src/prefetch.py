@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+import config
+
+
+class TokenBucket:
+    """Rate limit for upstream requests, refills rate tokens per second up to burst."""
+
+    def __init__(self, rate, burst):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        """Waits until tokens are available and takes them"""
+        tokens = min(tokens, self._burst)
+        while True:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self._tokens) / self._rate)
+
+
+class PrefetchScheduler:
+    """Keeps bazaar signals warm in redis, most overdue product first.
+
+    The RefreshQueue picks what's next, is_due(product_id) double checks redis (cheap,
+    another worker might have done it already). Due products are gathered into batches of up
+    to batch_size and refresh(product_ids) fetches/computes/stores a batch at once, returning
+    {product_id: result or exception}. Each product costs refresh_cost(product_id) upstream
+    requests from the budget, cost_per_refresh (a full refresh) when that isn't given. The
+    budget is this process's alone, every worker runs its own scheduler.
+
+    """
+
+    def __init__(self, queue, is_due, refresh, cost_per_refresh, budget_per_minute=None, concurrency=None,
+                 idle_sleep=None, batch_size=None, refresh_cost=None):
+        budget_per_minute = budget_per_minute or config.PREFETCH_BUDGET_PER_MINUTE
+        self._queue = queue
+        self._is_due = is_due
+        self._refresh = refresh
+        self._cost = refresh_cost or (lambda product_id: cost_per_refresh)
+        self._bucket = TokenBucket(budget_per_minute / 60, max(budget_per_minute / 60, cost_per_refresh))
+        self._budget_per_minute = budget_per_minute
+        self._semaphore = asyncio.Semaphore(concurrency or config.PREFETCH_CONCURRENCY)
+        self._idle_sleep = idle_sleep or config.PREFETCH_IDLE_SLEEP
+        self._batch_size = batch_size or config.PREFETCH_BATCH_SIZE
+        self._task = None
+        self._running = set()
+
+        self._refreshed = 0
+        self._skipped = 0
+        self._failures = 0
+        self._spent = 0
+
+    async def refresh_batch(self, product_ids):
+        """Refreshes a batch of products, failures are counted per product but don't stop the loop"""
+        try:
+            try:
+                results = await self._refresh(product_ids)
+            except Exception as e:
+                results = dict.fromkeys(product_ids, e)
+            for product_id in product_ids:
+                result = results.get(product_id)
+                if isinstance(result, BaseException):
+                    self._failures += 1
+                    self._queue.record_failure(product_id)
+                    print(f"Prefetch of {product_id} failed: {result}")
+                else:
+                    self._refreshed += 1
+        finally:
+            for product_id in product_ids:
+                self._queue.release(product_id)
+            self._semaphore.release()
+
+    def spawn(self, product_ids):
+        """Runs refresh_batch in the background, the semaphore caps how many at once"""
+        task = asyncio.create_task(self.refresh_batch(product_ids))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def gather_due(self, batch):
+        """Adds due products to batch until it's full or nothing else is due, paying the budget for
+        each as it goes. Returns how long until the next product is due, 0 if the batch filled up"""
+        while len(batch) < self._batch_size:
+            product_id, wait = self._queue.pop_due()
+            if product_id is None:
+                return wait
+            try:
+                due = await self._is_due(product_id)
+            except Exception:
+                self._queue.release(product_id)
+                raise
+            if not due:
+                self._skipped += 1
+                self._queue.touch(product_id)
+                continue
+            batch.append(product_id)
+            cost = self._cost(product_id)
+            await self._bucket.acquire(cost)
+            self._spent += cost
+        return 0
+
+    async def step(self):
+        """Refreshes the next batch of due products, or sleeps until one is due"""
+        await self._semaphore.acquire()
+        batch = []
+        try:
+            wait = await self.gather_due(batch)
+        except BaseException:
+            for product_id in batch:
+                self._queue.release(product_id)
+            self._semaphore.release()
+            raise
+        if not batch:
+            self._semaphore.release()
+            await asyncio.sleep(min(wait, self._idle_sleep))  # short naps so new hits get picked up
+            return
+        self.spawn(batch)
+
+    async def run(self):
+        """Works through the queue forever"""
+        while True:
+            try:
+                await self.step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Prefetch step failed: {e}")
+                await asyncio.sleep(self._idle_sleep)
+
+    def start(self):
+        """Starts the loop as a background task"""
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Cancels the loop and whatever refreshes are still running"""
+        tasks = list(self._running)
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        """Prefetch counters for /stats"""
+        return {
+            "budget_per_minute": self._budget_per_minute,
+            "batch_size": self._batch_size,
+            "requests_budgeted": self._spent,
+            "refreshed": self._refreshed,
+            "skipped_fresh": self._skipped,
+            "failures": self._failures,
+            "in_progress": len(self._running),
+        }
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from redis.asyncio import BlockingConnectionPool, Redis
+
+import config
+
+
+class RedisPool:
+    """One pooled async redis client shared by every handler and background job.
+
+    Connections are opened once and reused, and the health check runs as a
+    background ping instead of a ping on every request.
+
+    """
+
+    def __init__(self, url=None, max_connections=None, timeout=None, health_interval=None):
+        self._max_connections = max_connections or config.REDIS_MAX_CONNECTIONS
+        self._pool = BlockingConnectionPool.from_url(
+            url or config.REDIS_URL,
+            max_connections=self._max_connections,
+            timeout=timeout or config.REDIS_POOL_TIMEOUT,
+        )
+        self.client = Redis(connection_pool=self._pool)
+        self._health_interval = health_interval or config.REDIS_HEALTH_INTERVAL
+        self._task = None
+        self._healthy = None
+        self._last_ping_ms = None
+        self._last_error = None
+        self._failed_checks = 0
+
+    async def check_health(self):
+        """Pings redis once and remembers how it went"""
+        started = time.monotonic()
+        try:
+            await self.client.ping()
+        except Exception as e:
+            self._healthy = False
+            self._last_error = str(e)
+            self._failed_checks += 1
+            print(f"Redis health check failed: {e}")
+            return False
+        self._healthy = True
+        self._last_ping_ms = (time.monotonic() - started) * 1000
+        return True
+
+    async def health_loop(self):
+        """Pings every health_interval seconds until cancelled"""
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self._health_interval)
+
+    def start(self):
+        """Starts the background health check"""
+        self._task = asyncio.create_task(self.health_loop())
+
+    async def stop(self):
+        """Stops the health check and closes every pooled connection"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.client.aclose()
+        await self._pool.disconnect()
+
+    def stats(self):
+        """In use/idle connection counts and the last health check, for /stats"""
+        in_use = len(self._pool._in_use_connections)
+        return {
+            "max_connections": self._max_connections,
+            "in_use": in_use,
+            "idle": len(self._pool._available_connections),
+            "utilisation": in_use / self._max_connections,
+            "healthy": self._healthy,
+            "last_ping_ms": self._last_ping_ms,
+            "failed_checks": self._failed_checks,
+            "last_error": self._last_error,
+        }
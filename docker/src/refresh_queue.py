@@ -0,0 +1,177 @@
+import heapq
+import math
+import time
+
+import config
+
+
+class DecayingCounter:
+    """Hit counter that halves every half_life seconds, so old popularity fades out."""
+
+    def __init__(self, half_life):
+        self._decay = math.log(2) / half_life
+        self._value = 0.0
+        self._updated = time.time()
+
+    def value(self, now=None):
+        """Current decayed count"""
+        now = now or time.time()
+        return self._value * math.exp(-self._decay * max(0.0, now - self._updated))
+
+    def add(self, amount=1.0, now=None):
+        """Adds a hit"""
+        now = now or time.time()
+        self._value = self.value(now) + amount
+        self._updated = now
+
+
+class ProductState:
+    """What the queue knows about one product."""
+
+    def __init__(self, half_life):
+        self.hits = DecayingCounter(half_life)
+        self.last_refresh = 0.0  # never refreshed, so it's due right away
+        self.volatility = 0.0
+        self.failures = 0
+        self.version = 0  # bumped on every reschedule, older heap entries get skipped
+        self.in_flight = False
+
+
+class RefreshQueue:
+    """Decides which product the prefetcher refreshes next.
+
+    Each product gets a refresh interval that shrinks with how often it's searched
+    (decaying /items/ hit count) and how volatile it was on its last refresh. The heap
+    is ordered by when that interval runs out, so hot volatile items come up often
+    and dead ones rarely.
+
+    """
+
+    def __init__(self, products, min_interval=None, max_interval=None, half_life=None,
+                 popularity_weight=None, volatility_weight=None):
+        self._min_interval = min_interval or config.REFRESH_MIN_INTERVAL
+        self._max_interval = max(max_interval or config.REFRESH_MAX_INTERVAL, self._min_interval)
+        self._half_life = half_life or config.REFRESH_HIT_HALF_LIFE
+        self._popularity_weight = config.REFRESH_POPULARITY_WEIGHT if popularity_weight is None else popularity_weight
+        self._volatility_weight = config.REFRESH_VOLATILITY_WEIGHT if volatility_weight is None else volatility_weight
+        self._states = {}
+        self._heap = []
+        for product_id in products:
+            self._states[product_id] = ProductState(self._half_life)
+            self._push(product_id)
+
+    def _state(self, product_id):
+        state = self._states.get(product_id)
+        if state is None:
+            state = self._states[product_id] = ProductState(self._half_life)
+        return state
+
+    def _push(self, product_id, now=None):
+        """(Re)schedules a product, any older heap entry for it becomes dead"""
+        state = self._state(product_id)
+        state.version += 1
+        heapq.heappush(self._heap, (self.next_due(product_id), -state.hits.value(now), state.version, product_id))
+        if len(self._heap) > 4 * len(self._states):
+            self._compact()
+
+    def _compact(self):
+        """Drops dead entries, hits push a new entry each time so the heap grows otherwise"""
+        self._heap = [entry for entry in self._heap
+                      if entry[2] == self._states[entry[3]].version and not self._states[entry[3]].in_flight]
+        heapq.heapify(self._heap)
+
+    def refresh_interval(self, product_id, now=None):
+        """Seconds between refreshes for a product, clamped to the min/max interval"""
+        state = self._state(product_id)
+        if state.failures:
+            return self._max_interval  # back off items coflnet doesn't know
+        weight = (1 + self._popularity_weight * state.hits.value(now)
+                  + self._volatility_weight * abs(state.volatility))
+        return min(self._max_interval, max(self._min_interval, self._max_interval / weight))
+
+    def next_due(self, product_id, now=None):
+        """When the product should be refreshed again"""
+        return self._state(product_id).last_refresh + self.refresh_interval(product_id, now)
+
+    def score(self, product_id, now=None):
+        """How overdue a product is, >= 1 means it's due (age / interval)"""
+        now = now or time.time()
+        state = self._state(product_id)
+        return (now - state.last_refresh) / self.refresh_interval(product_id, now)
+
+    def record_hit(self, product_id, now=None):
+        """Called for every /items/ request so popular products move up"""
+        state = self._state(product_id)
+        state.hits.add(1.0, now)
+        if not state.in_flight:
+            self._push(product_id, now)
+
+    def record_refresh(self, product_id, volatility, now=None):
+        """Called after a product was recomputed, by the prefetcher or a user miss"""
+        state = self._state(product_id)
+        state.last_refresh = now or time.time()
+        state.volatility = volatility
+        state.failures = 0
+        state.in_flight = False
+        self._push(product_id, now)
+
+    def record_failure(self, product_id, now=None):
+        """Refresh failed, try again after the max interval"""
+        state = self._state(product_id)
+        state.last_refresh = now or time.time()
+        state.failures += 1
+        state.in_flight = False
+        self._push(product_id, now)
+
+    def touch(self, product_id, now=None):
+        """Product was fresh already (another worker did it), count that as a refresh"""
+        state = self._state(product_id)
+        state.last_refresh = now or time.time()
+        state.in_flight = False
+        self._push(product_id, now)
+
+    def release(self, product_id, now=None):
+        """Puts a popped product back if nothing recorded a refresh for it (e.g. another worker had the lock)"""
+        if self._state(product_id).in_flight:
+            self.touch(product_id, now)
+
+    def pop_due(self, now=None):
+        """Returns (product_id, 0) for the most overdue product or (None, seconds until the next one)"""
+        now = now or time.time()
+        while self._heap:
+            due, _, version, product_id = self._heap[0]
+            state = self._states[product_id]
+            if version != state.version or state.in_flight:
+                heapq.heappop(self._heap)  # rescheduled since, skip the old entry
+                continue
+            if due > now:
+                return None, due - now
+            heapq.heappop(self._heap)
+            state.in_flight = True
+            return product_id, 0
+        return None, self._max_interval
+
+    def snapshot(self, limit=50, now=None):
+        """Queue contents ordered by how overdue they are, for the debug endpoint.
+
+        Products that were never refreshed come first, their score, due_in and age are None
+        since there is no refresh to measure from.
+        """
+        now = now or time.time()
+        rows = []
+        for product_id, state in self._states.items():
+            never = not state.last_refresh
+            rows.append({
+                "product_id": product_id,
+                "never_refreshed": never,
+                "score": None if never else self.score(product_id, now),
+                "refresh_interval": self.refresh_interval(product_id, now),
+                "due_in": None if never else self.next_due(product_id, now) - now,
+                "age": None if never else now - state.last_refresh,
+                "hits": state.hits.value(now),
+                "volatility": state.volatility,
+                "failures": state.failures,
+                "in_flight": state.in_flight,
+            })
+        rows.sort(key=lambda row: (row["never_refreshed"], row["score"] or 0.0), reverse=True)
+        return {"size": len(self._states), "heap_entries": len(self._heap), "items": rows[:limit]}
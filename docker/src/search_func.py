@@ -1,3 +1,28 @@
+_product_index = None
+
+
+def normalize(item):
+    """Same normalisation get_item uses, spaces and case don't matter"""
+    return item.replace(" ", "").lower()
+
+
+def product_index():
+    """Normalised item name or product id -> product id, built once per process"""
+    global _product_index
+    if _product_index is None:
+        from items_list import baz_items
+        index = {normalize(name): product_id for name, product_id in baz_items.items()}
+        index.update({normalize(product_id): product_id for product_id in baz_items.values()})  # an exact id wins over a name
+        _product_index = index
+    return _product_index
+
+
+def product_ids():
+    """Every distinct product id in baz_items"""
+    from items_list import baz_items
+    return sorted(set(baz_items.values()))
+
+
 class ItemSearch:
     """This class is used to search an item and return it."""
 
@@ -27,6 +52,10 @@ class ItemSearch:
 
         return possible_item_names
 
+    def get_product_id(self, item):
+        """Returns the product id for an exact item name or product id, None otherwise"""
+        return product_index().get(normalize(item))
+
 
 class Search_Fun:
     """This class above function and searches it and returns false if the item doesn't exist."""
@@ -43,4 +72,8 @@ class Search_Fun:
         elif len(curr_item) > 1:
             return False
         else:
-            return curr_item
\ No newline at end of file
+            return curr_item
+
+    def product_id(self, item):
+        """Canonical product id of a search, so aliases and spacing share one cache entry"""
+        return self._search_function.get_product_id(item)
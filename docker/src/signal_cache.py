@@ -0,0 +1,211 @@
+import json
+import math
+import random
+import time
+
+from redis.exceptions import RedisError
+
+import config
+
+
+def signal_key(product_id):
+    """Redis key of a product's signal, one per product no matter which alias was searched"""
+    return f"signal:{product_id}"
+
+
+class CacheEntry:
+    """A cached signal and the two times that matter for it.
+
+    Before soft_expires it's fresh, between soft_expires and hard_expires it's
+    stale (still served, but refreshed in the background), after that it's a miss.
+
+    """
+
+    def __init__(self, value, soft_expires, hard_expires, delta=0.0):
+        self.value = value  # InvestmentSignal json
+        self.soft_expires = soft_expires
+        self.hard_expires = hard_expires
+        self.delta = delta  # seconds the last recompute took
+
+    def is_fresh(self, now=None):
+        """True until the soft ttl runs out"""
+        return (now or time.time()) < self.soft_expires
+
+    def is_expired(self, now=None):
+        """True once the hard ttl runs out"""
+        return (now or time.time()) >= self.hard_expires
+
+    def should_refresh_early(self, beta, now=None, rand=None):
+        """XFetch: refresh a fresh entry early with a probability that grows towards soft_expires.
+
+        Entries that took long to compute start rolling the dice earlier. Every worker
+        decides on its own, so there's no coordination and no synchronized spike.
+        """
+        if beta <= 0 or self.delta <= 0:
+            return False
+        rand = rand or random.random()
+        return (now or time.time()) - self.delta * beta * math.log(rand) >= self.soft_expires
+
+    def encode(self):
+        """Json that goes into redis"""
+        return json.dumps({
+            "value": self.value,
+            "soft_expires": self.soft_expires,
+            "hard_expires": self.hard_expires,
+            "delta": self.delta,
+        })
+
+    @classmethod
+    def decode(cls, raw):
+        """Reads an entry back, plain signals from before the envelope count as stale"""
+        data = json.loads(raw)
+        if "soft_expires" not in data:
+            value = raw.decode() if isinstance(raw, bytes) else raw
+            return cls(value, 0, float("inf"))
+        return cls(data["value"], data["soft_expires"], data["hard_expires"], data.get("delta", 0.0))
+
+
+class SignalCache:
+    """Reads and writes CacheEntry's in redis.
+
+    If a LocalCache is given it sits in front of redis, hot products are then served
+    without a network hop and the Invalidator keeps the other workers' copies honest.
+    With a TrackingCache instead, reads go through redis client side caching and redis
+    does the invalidating.
+
+    """
+
+    def __init__(self, soft_ttl=None, hard_ttl=None, jitter=None, beta=None, local_cache=None, invalidator=None,
+                 tracker=None):
+        self._local_cache = local_cache
+        self._invalidator = invalidator
+        self._tracker = tracker
+        self._soft_ttl = soft_ttl or config.SIGNAL_SOFT_TTL
+        self._hard_ttl = max(hard_ttl or config.SIGNAL_HARD_TTL, self._soft_ttl)
+        self._jitter = config.SIGNAL_TTL_JITTER if jitter is None else jitter
+        self._beta = config.XFETCH_BETA if beta is None else beta
+        self._fresh_hits = 0
+        self._stale_hits = 0
+        self._early_refreshes = 0
+        self._misses = 0
+        self._writes = 0
+        self._ttl_total = 0
+
+    def ttls(self, soft_ttl=None):
+        """(soft, hard) ttl for a write with jitter applied, the hard ttl never ends before the soft one"""
+        soft_ttl = soft_ttl or self._soft_ttl
+        spread = random.uniform(1 - self._jitter, 1 + self._jitter)
+        soft_ttl = max(1, int(soft_ttl * spread))
+        return soft_ttl, max(int(self._hard_ttl * spread), soft_ttl)
+
+    def make_entry(self, value, soft_ttl, hard_ttl, delta=0.0, now=None):
+        """Wraps a signal json with its soft/hard expiry"""
+        now = now or time.time()
+        return CacheEntry(value, now + soft_ttl, now + hard_ttl, delta)
+
+    def needs_refresh(self, entry, now=None):
+        """Stale entries always get refreshed, fresh ones sometimes do early (XFetch)"""
+        if not entry.is_fresh(now):
+            return True
+        if entry.should_refresh_early(self._beta, now):
+            self._early_refreshes += 1
+            return True
+        return False
+
+    async def read(self, client, key):
+        """Raw value for key, local copy first then redis"""
+        if self._tracker is not None:
+            try:
+                return await self._tracker.get(key)
+            except (RedisError, OSError):
+                pass  # tracking connection is reconnecting, plain read below
+
+        raw = self._local_cache.get(key) if self._local_cache is not None else None
+        if raw is None:
+            raw = await client.get(key)
+            if raw and self._local_cache is not None:
+                self._local_cache.set(key, raw)
+        return raw
+
+    async def read_many(self, client, keys):
+        """Raw values for keys in order, local copies first and one MGET for the rest"""
+        if self._tracker is not None:
+            try:
+                return await self._tracker.get_many(keys)
+            except (RedisError, OSError):
+                pass
+
+        values = [self._local_cache.get(key) if self._local_cache is not None else None for key in keys]
+        missing = [key for key, raw in zip(keys, values) if raw is None]
+        if missing:
+            fetched = dict(zip(missing, await client.mget(missing)))
+            for key, raw in fetched.items():
+                if raw and self._local_cache is not None:
+                    self._local_cache.set(key, raw)
+            values = [fetched[key] if raw is None else raw for key, raw in zip(keys, values)]
+        return values
+
+    async def get(self, client, key):
+        """Returns the entry for key, None if there isn't one or it's past the hard ttl"""
+        raw = await self.read(client, key)
+        entry = CacheEntry.decode(raw) if raw else None
+        if entry is None or entry.is_expired():
+            self._misses += 1
+            return None
+
+        if entry.is_fresh():
+            self._fresh_hits += 1
+        else:
+            self._stale_hits += 1
+        return entry
+
+    async def get_many(self, client, keys):
+        """get for several keys at once, returns {key: entry or None}"""
+        keys = list(dict.fromkeys(keys))
+        entries = {}
+        for key, raw in zip(keys, await self.read_many(client, keys)):
+            entry = CacheEntry.decode(raw) if raw else None
+            if entry is None or entry.is_expired():
+                self._misses += 1
+                entry = None
+            elif entry.is_fresh():
+                self._fresh_hits += 1
+            else:
+                self._stale_hits += 1
+            entries[key] = entry
+        return entries
+
+    async def peek(self, client, key):
+        """Like get but doesn't count towards the hit/miss stats, for background jobs"""
+        raw = await self.read(client, key)
+        entry = CacheEntry.decode(raw) if raw else None
+        if entry is None or entry.is_expired():
+            return None
+        return entry
+
+    async def set(self, client, key, value, soft_ttl=None, delta=0.0):
+        """Stores a signal json and how long it took to compute, redis drops the key itself at the hard ttl"""
+        soft_ttl, hard_ttl = self.ttls(soft_ttl)
+        entry = self.make_entry(value, soft_ttl, hard_ttl, delta)
+        raw = entry.encode()
+        await client.set(key, raw, ex=hard_ttl)
+        if self._local_cache is not None:
+            self._local_cache.set(key, raw)
+        if self._invalidator is not None:
+            await self._invalidator.publish(client, key)  # other workers drop their old copy
+        self._writes += 1
+        self._ttl_total += soft_ttl
+        return entry
+
+    def stats(self):
+        """Hit/miss counters for /stats"""
+        return {
+            "soft_ttl": self._soft_ttl,
+            "hard_ttl": self._hard_ttl,
+            "fresh_hits": self._fresh_hits,
+            "stale_hits": self._stale_hits,
+            "early_refreshes": self._early_refreshes,
+            "misses": self._misses,
+            "writes": self._writes,
+            "avg_written_ttl": self._ttl_total / self._writes if self._writes else None,
+        }
@@ -0,0 +1,129 @@
+import asyncio
+import sys
+import time
+
+import httpx
+
+import config
+from api_call import Api
+from history_store import resample, sample_step
+from time_index import DAY, HOUR, WEEK
+
+# trailing span and bucket size of the views coflnet's /history/{horizon} endpoints return
+VIEWS = {
+    "day": (DAY, config.SINGLE_CALL_DAY_STEP),
+    "hour": (HOUR, config.SINGLE_CALL_HOUR_STEP),
+    "week": (WEEK, config.SINGLE_CALL_WEEK_STEP),
+}
+
+
+def view(item, span, step, now=None):
+    """The finished step sized buckets of item's trailing span at now, like one horizon endpoint.
+
+    The range endpoint can include the minute still in progress, so the view ends at the
+    request time and not a sample past the newest one, or that minute would pass for finished.
+    """
+    newest = item.time_index().last()
+    if newest is None:
+        return item
+    covered = newest + (sample_step(item) or 0.0)  # a sample covers [time, time + step)
+    if now is not None:
+        covered = min(covered, now)
+    end = covered - covered % step
+    start = end - span - (end - span) % step
+    return resample(item.between(start, end), step, start)
+
+
+def split_views(item, now=None):
+    """(day, hour, week) Items from one fine history fetched at now, None stays None"""
+    if item is None:
+        return None, None, None
+    return tuple(view(item, *VIEWS[horizon], now) for horizon in ("day", "hour", "week"))
+
+
+class SingleCallApi(Api):
+    """Api that asks coflnet for the last week once and derives the hour/day/week views itself.
+
+    One upstream request per item instead of three. How fine the range endpoint's samples are
+    decides how close the views get to the real endpoints, compare_modes checks that.
+
+    """
+
+    def range_url(self, start, end):
+        """Coflnet history url between two epoch times"""
+        return config.SINGLE_CALL_URL.format(
+            item=self.get_api_item(),
+            start=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(start)),
+            end=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(end)),
+        )
+
+    async def call_api_range(self, client, parse=True, now=None):
+        """The one request covering the week view up to now, parse=False returns the raw body"""
+        now = time.time() if now is None else now
+        api_response = await client.get(self.range_url(now - WEEK - config.SINGLE_CALL_WEEK_STEP, now))
+        if self.check_status(api_response.status_code):
+            if not parse:
+                return api_response.content
+            return self.parse_history(api_response.json())
+
+    async def call_api_all(self, client=None, parse=True):
+        """Same result as Api.call_api_all from one request, parse=False gives (raw body, request time)"""
+        own_client = client is None
+        if own_client:
+            client = httpx.AsyncClient()
+        now = time.time()
+        try:
+            result = await self.call_api_range(client, parse, now)
+        finally:
+            if own_client:
+                await client.aclose()
+
+        if not parse:
+            return result, now
+        return split_views(result, now)
+
+    def parse_results(self, raw_result):
+        """Parses call_api_all(parse=False)'s body into the three views"""
+        content, now = raw_result
+        return split_views(self.parse_raw(content), now)
+
+
+def compare_modes(three_call, single_call, search):
+    """Metrics of both fetch modes side by side, with each horizon's sample spacing.
+
+    Both are (day, hour, week) results, returns {"signals": (three, single), "metrics":
+    {name: (three, single, relative difference)}, "steps": {horizon: (three, single)}}.
+    """
+    from Bazaar_Algo import Main
+    three, single = Main().score_result(three_call, search), Main().score_result(single_call, search)
+    metrics = {}
+    for name, value in three["metrics"].items():
+        if isinstance(value, str):
+            continue
+        other = single["metrics"][name]
+        metrics[name] = (value, other, abs(other - value) / max(abs(value), 1e-12))
+    steps = {horizon: (sample_step(a), sample_step(b))
+             for horizon, a, b in zip(("day", "hour", "week"), three_call, single_call)}
+    return {"signals": (three["Signal"], single["Signal"]), "metrics": metrics, "steps": steps}
+
+
+async def verify(product_ids):
+    """Fetches every product both ways and prints how far apart the metrics are"""
+    async with httpx.AsyncClient() as client:
+        for product_id in product_ids:
+            three_api, single_api = Api(), SingleCallApi()
+            three_api.set_api_item(product_id)
+            single_api.set_api_item(product_id)
+            three, single = await asyncio.gather(three_api.call_api_all(client), single_api.call_api_all(client))
+            if None in three or None in single:
+                print(f"{product_id}: upstream error")
+                continue
+            result = compare_modes(three, single, product_id)
+            worst = max(result["metrics"].items(), key=lambda metric: metric[1][2])
+            print(f"{product_id}: signals {result['signals']}, worst {worst[0]} off by {worst[1][2]:.2%}, "
+                  f"steps {result['steps']}")
+
+
+# Run with product ids to check single call mode against the real endpoints before turning it on
+if __name__ == "__main__":
+    asyncio.run(verify(sys.argv[1:] or ["ENCHANTED_DIAMOND"]))
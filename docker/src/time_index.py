@@ -0,0 +1,52 @@
+import numpy as np
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+
+def time_order(times):
+    """Positions that sort times ascending (stable, missing times last), None if they already are"""
+    if len(times) < 2 or (not np.isnan(times[-1]) and np.all(times[1:] >= times[:-1])):
+        return None
+    return np.argsort(times, kind="stable")  # NaN sorts last
+
+
+class TimeIndex:
+    """Sorted sample times (epoch seconds) answering range lookups by binary search.
+
+    Samples without a time sit after the dated ones and are never part of a range.
+
+    """
+
+    def __init__(self, times):
+        self.times = times
+        self.dated = int(np.count_nonzero(~np.isnan(times)))
+
+    def __len__(self):
+        return len(self.times)
+
+    def first(self):
+        """Oldest sample time, None without dated samples"""
+        return float(self.times[0]) if self.dated else None
+
+    def last(self):
+        """Newest sample time, None without dated samples"""
+        return float(self.times[self.dated - 1]) if self.dated else None
+
+    def span(self, start=None, end=None):
+        """slice of the samples with start <= time < end, either side open if None"""
+        dated = self.times[:self.dated]
+        lo = 0 if start is None else int(np.searchsorted(dated, start, side="left"))
+        hi = self.dated if end is None else int(np.searchsorted(dated, end, side="left"))
+        return slice(lo, max(lo, hi))
+
+    def trailing(self, seconds, now=None):
+        """slice of the samples in (now - seconds, now], now is the newest sample unless given"""
+        now = self.last() if now is None else now
+        if now is None:
+            return slice(0, 0)
+        dated = self.times[:self.dated]
+        lo = int(np.searchsorted(dated, now - seconds, side="right"))
+        hi = int(np.searchsorted(dated, now, side="right"))
+        return slice(lo, max(lo, hi))
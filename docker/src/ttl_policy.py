@@ -0,0 +1,30 @@
+import math
+
+import config
+
+
+def finite(value):
+    """Metrics can come out as inf/nan when coflnet returns zeros, count those as 0"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return value if math.isfinite(value) else 0.0
+
+
+def activity(metrics):
+    """How fast an item is moving, 0 for a calm illiquid item"""
+    volatility = abs(finite(metrics.get("volatility")))
+    momentum = abs(finite(metrics.get("price_momentum"))) * 100  # momentum is a fraction, make it %
+    relative_volume = max(0.0, finite(metrics.get("relative_volume")))
+    return (config.TTL_VOLATILITY_WEIGHT * volatility
+            + config.TTL_MOMENTUM_WEIGHT * momentum
+            + config.TTL_VOLUME_WEIGHT * math.log1p(relative_volume))
+
+
+def adaptive_ttl(metrics, min_ttl=None, max_ttl=None):
+    """Soft ttl in seconds for a signal, derived from the metrics Main.metrics produces"""
+    min_ttl = min_ttl or config.SIGNAL_MIN_TTL
+    max_ttl = max(max_ttl or config.SIGNAL_MAX_TTL, min_ttl)
+    ttl = max_ttl / (1 + activity(metrics))
+    return int(min(max_ttl, max(min_ttl, ttl)))
@@ -0,0 +1,284 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from api_call import FIELDS, Item
+from hourly_summaries import HourlySummaries
+from online_metrics import OnlineMetrics
+from time_index import DAY, HOUR, WEEK
+
+# how a coarser sample sums up the finer ones inside it, everything else is averaged
+AGGREGATES = {"maxSell": np.maximum, "maxBuy": np.maximum, "minBuy": np.minimum, "minSell": np.minimum}
+
+
+def sample_step(item):
+    """Typical spacing of item's samples in seconds, None with fewer than two dated samples"""
+    index = item.time_index()
+    times = item.get_timestamps()[:index.dated]
+    if len(times) < 2:
+        return None
+    return float(np.median(np.diff(times)))
+
+
+def merge(old, new):
+    """One Item with the dated samples of both, new wins where both have a sample at the same time"""
+    new_dated, old_dated = new.time_index().dated, old.time_index().dated
+    times = np.concatenate([new.get_timestamps()[:new_dated], old.get_timestamps()[:old_dated]])
+    columns = np.concatenate([new.get_columns()[:, :new_dated], old.get_columns()[:, :old_dated]], axis=1)
+    times, first = np.unique(times, return_index=True)  # first occurrence, so the new sample
+    return Item(np.ascontiguousarray(columns[:, first]), times)
+
+
+def resample(item, step, start):
+    """Buckets item's samples into [start + k * step, start + (k + 1) * step) from start on.
+
+    Every bucket with samples becomes one sample stamped with the bucket start: max fields
+    keep the max, min fields the min, prices and volumes are averaged, NaN values are left out.
+    """
+    window = item.between(start)
+    times = window.get_timestamps()
+    if not len(times):
+        return Item()
+    buckets = np.floor((times - start) / step).astype(np.int64)
+    firsts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])  # times are sorted, buckets are runs
+    values = window.get_columns()
+    present = ~np.isnan(values)
+    counts = np.add.reduceat(present, firsts, axis=1)
+
+    columns = np.empty((len(FIELDS), len(firsts)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for row, field in enumerate(FIELDS):
+            aggregate = AGGREGATES.get(field)
+            if aggregate is np.maximum:
+                summed = aggregate.reduceat(np.where(present[row], values[row], -np.inf), firsts)
+            elif aggregate is np.minimum:
+                summed = aggregate.reduceat(np.where(present[row], values[row], np.inf), firsts)
+            else:
+                summed = np.add.reduceat(np.where(present[row], values[row], 0.0), firsts) / counts[row]
+            columns[row] = np.where(counts[row] > 0, summed, np.nan)
+    return Item(columns, start + buckets[firsts] * step)
+
+
+class ProductHistory:
+    """The day/hour/week views of one product plus the recent fine samples they get extended from"""
+
+    def __init__(self, day, hour, week, now, online=False):
+        self.day, self.hour, self.week = day, hour, week
+        self.day_step = sample_step(day)
+        self.week_step = sample_step(week)
+        self.hour_step = sample_step(hour) or 0.0  # a sample covers [time, time + step)
+        self.fine = merge(Item(), hour)  # dated hour samples not yet folded into day and week
+        self.complete_from = self.fine.time_index().first()  # fine has every sample from here on
+        self.seeded_at = self.updated_at = now
+        self.online = None
+        if online:
+            self.online = OnlineMetrics()
+            self.online.update(self.views())
+
+    def usable(self):
+        """Can only be extended if we know the day/week spacing and have dated hour samples"""
+        return bool(self.day_step and self.week_step and self.fine.time_index().dated)
+
+    def views(self):
+        return self.day, self.hour, self.week
+
+    def reaches(self, now):
+        """Whether an hour history fetched at now still goes back to our newest sample.
+
+        Its oldest sample is at most an hour before now, so anything older than that (less a
+        sample of slack) can't overlap and only a full fetch fills the gap.
+        """
+        newest = self.fine.time_index().last()
+        return newest is not None and newest > now - HOUR + self.hour_step
+
+    def covers(self, now):
+        """Whether the fine samples go back to the start of every day/week bucket finished by now.
+
+        At a seed they only reach an hour back, so a seed more than an hour into the open 2 hour
+        week bucket can't sum that bucket up from them. Once it finishes only a full fetch has it.
+        """
+        for series, step in ((self.day, self.day_step), (self.week, self.week_step)):
+            next_start = series.time_index().last() + step
+            if next_start + step <= now and self.complete_from > next_start:
+                return False
+        return True
+
+    def extend(self, series, step, window):
+        """series plus the finished buckets of the fine samples, cut back to the trailing window"""
+        next_start = series.time_index().last() + step
+        covered = self.fine.time_index().last() + self.hour_step
+        finished = int((covered - next_start) // step)  # buckets the fine samples cover all of
+        if finished > 0 and self.complete_from <= next_start:  # else they start inside the bucket, see covers()
+            buckets = resample(self.fine.between(next_start, next_start + finished * step), step, next_start)
+            series = merge(series, buckets)
+        return series.last(window)
+
+    def merge_hour(self, hour, now):
+        """Folds a new hour history in, False if it doesn't overlap what we have (a gap, needs a reseed)"""
+        first, newest = hour.time_index().first(), self.fine.time_index().last()
+        if first is None or newest is None or first > newest:
+            return False
+        self.hour = hour
+        self.fine = merge(self.fine, hour)
+        self.day = self.extend(self.day, self.day_step, DAY)
+        self.week = self.extend(self.week, self.week_step, WEEK)
+        pending = min(self.day.time_index().last() + self.day_step, self.week.time_index().last() + self.week_step)
+        # older fine samples are in both series already, the newest stays for the next overlap check
+        cut = min(pending, self.fine.time_index().last())
+        self.fine = self.fine.between(cut)
+        self.complete_from = max(self.complete_from, cut)
+        if self.online is not None:
+            self.online.update(self.views())  # only the samples past what it has
+        self.updated_at = now
+        return True
+
+
+def merge_raw_hour(api, history, raw, now):
+    """Parses a raw hour body and folds it into history, returns (hour, whether it merged)"""
+    hour = api.parse_raw(raw)
+    return hour, history.merge_hour(hour, now)
+
+
+def seed_raw(api, raw, now, online):
+    """Parses call_api_all(parse=False)'s bodies, returns ((day, hour, week), ProductHistory or None)"""
+    result = api.parse_results(raw)
+    if any(horizon is None for horizon in result):
+        return result, None
+    return result, ProductHistory(*result, now, online)
+
+
+class HistoryStore:
+    """Recent coflnet history per product, so refreshing one mostly needs just the hour call.
+
+    The first fetch of a product (and one every reseed interval after) downloads all three
+    horizons. After that only the hour history is requested: it is the new hour view, and its
+    samples are bucketed at the day and week series' own spacing, appended to them by time
+    and cut back to the trailing day and week. If the new hour doesn't overlap the stored
+    samples it falls back to a full fetch. When the newest stored sample is already more than
+    an hour old (nobody asked for the product in a while), or a day/week bucket finished that
+    the stored samples don't reach the start of, the hour call is skipped and it goes straight
+    to the full fetch, incremental() tells which of the two the next fetch does.
+    With online set every product also keeps OnlineMetrics fed with the new samples, with
+    hourly it keeps HourlySummaries that window() merges for any span, in an LRU of their own
+    since a product's summaries take far more memory than its history.
+
+    """
+
+    def __init__(self, max_size=None, reseed_interval=None, online=None, hourly=None, hourly_size=None):
+        self._max_size = max_size or config.HISTORY_STORE_SIZE
+        self._reseed_interval = reseed_interval or config.HISTORY_RESEED_INTERVAL
+        self._online = config.ONLINE_METRICS if online is None else online
+        self._hourly = config.HOURLY_SUMMARIES if hourly is None else hourly
+        self._hourly_size = hourly_size or config.HOURLY_SUMMARIES_SIZE
+        self._histories = OrderedDict()  # product id -> ProductHistory, least recently used first
+        self._summaries = OrderedDict()  # product id -> HourlySummaries, same but outlives reseeds and evictions
+        self._seeds = 0
+        self._increments = 0
+        self._gaps = 0
+        self._expired = 0
+        self._evictions = 0
+        self._samples_downloaded = 0
+
+    def store(self, product_id, history):
+        """Keeps a product's history, dropping the least recently used past max_size"""
+        self._histories[product_id] = history
+        self._histories.move_to_end(product_id)
+        while len(self._histories) > self._max_size:
+            self._histories.popitem(last=False)
+            self._evictions += 1
+
+    async def fetch(self, api, client):
+        """(day, hour, week) for api's current item, same as Api.call_api_all returns.
+
+        The bodies come in raw and are parsed, resampled and merged in a thread, off the event
+        loop like the scoring is. The LRU and the counters are only touched back on the loop.
+        """
+        product_id = api.get_api_item()
+        now = time.time()
+        history = self._histories.get(product_id)
+        if history is not None and not self.incremental(product_id, now):
+            self._expired += 1  # due a reseed, too old to overlap or short of a bucket, the hour call would be wasted
+        elif history is not None:
+            raw = await api.call_api_async(client, "hour", parse=False)
+            if raw is None:
+                return history.day, None, history.week  # upstream error, same as a failed call_api_all
+            hour, merged = await asyncio.to_thread(merge_raw_hour, api, history, raw, now)
+            self._samples_downloaded += len(hour)
+            if merged:
+                self._increments += 1
+                if product_id in self._histories:  # unless it was evicted while we were away
+                    self._histories.move_to_end(product_id)
+                self.update_summaries(product_id, history)
+                return history.views()
+            self._gaps += 1
+            self._histories.pop(product_id, None)
+
+        raw = await api.call_api_all(client, parse=False)
+        result, history = await asyncio.to_thread(seed_raw, api, raw, now, self._online)
+        self._seeds += 1
+        if all(horizon is not None for horizon in result):
+            self._samples_downloaded += sum(len(horizon) for horizon in result)
+            if history.usable():
+                self.store(product_id, history)
+                self.update_summaries(product_id, history)
+        return result
+
+    def update_summaries(self, product_id, history):
+        """Adds the product's new samples to its HourlySummaries, least recently used products are
+        dropped past hourly_size. Only samples past what the summaries have go in, so a reseed or
+        a product coming back after its summaries were dropped fills in from the coarser views."""
+        if not self._hourly:
+            return
+        summaries = self._summaries.pop(product_id, None) or HourlySummaries()
+        self._summaries[product_id] = summaries
+        while len(self._summaries) > self._hourly_size:
+            self._summaries.popitem(last=False)
+        summaries.seed(*history.views(), history.day_step, history.hour_step, history.week_step)
+
+    def incremental(self, product_id, now=None):
+        """Whether the next fetch of a product only makes the hour call, for budgeting upstream requests"""
+        history = self._histories.get(product_id)
+        now = time.time() if now is None else now
+        return (history is not None and now - history.seeded_at < self._reseed_interval and history.reaches(now)
+                and history.covers(now))
+
+    def online_metrics(self, product_id):
+        """The product's OnlineMetrics, None if it isn't stored or the store keeps none"""
+        history = self._histories.get(product_id)
+        return history.online if history is not None else None
+
+    @property
+    def hourly(self):
+        return self._hourly
+
+    def summarized(self, product_id):
+        """Whether the product has HourlySummaries here"""
+        return product_id in self._summaries
+
+    def window(self, product_id, start=None, end=None):
+        """The product's merged HourBucket for [start, end), None if it isn't stored or has no hours there"""
+        summaries = self._summaries.get(product_id)
+        if summaries is None:
+            return None
+        self._summaries.move_to_end(product_id)
+        return summaries.window(start, end)
+
+    def stats(self):
+        """Store counters for /stats"""
+        return {
+            "products": len(self._histories),
+            "max_size": self._max_size,
+            "online_metrics": self._online,
+            "hourly_summaries": self._hourly,
+            "hourly_products": len(self._summaries),
+            "hourly_max_size": self._hourly_size,
+            "seeds": self._seeds,
+            "increments": self._increments,
+            "gaps": self._gaps,
+            "expired": self._expired,
+            "evictions": self._evictions,
+            "samples_downloaded": self._samples_downloaded,
+        }
@@ -0,0 +1,155 @@
+import bisect
+
+import numpy as np
+
+import config
+from api_call import FIELDS
+from quantiles import TDigest
+from time_index import HOUR
+
+STATS = ("count", "weight", "sum", "squares", "min", "max")  # rows of HourBucket.stats, weights are seconds
+VOLUMES = {FIELDS.index("buy"): FIELDS.index("buyVolume"), FIELDS.index("sell"): FIELDS.index("sellVolume")}
+SKETCHED = tuple(VOLUMES)  # series that also get a TDigest, the prices percentile bands are asked for
+PERCENTILES = {"p5": 0.05, "p50": 0.5, "p95": 0.95}  # band reported for the sketched series
+
+
+class HourBucket:
+    """Mergeable summary of every series over some samples, one hour of them or many merged.
+
+    Each sample is weighted by the seconds it covers, so an hour filled from 2 hour week
+    samples, 5 minute day samples or 1 minute hour samples averages by time either way.
+    Count, weight, sums, squares, min and max per series are a (len(STATS), len(FIELDS))
+    array, the buy/sell VWAP sums and digests sit next to it. Merging adds the sums up and
+    merges the digests, nothing goes back to the samples.
+
+    """
+
+    def __init__(self, stats, vwap, digests):
+        self.stats = stats
+        self.vwap = vwap  # {price row: [sum of weight * volume * price, sum of weight * volume]}
+        self.digests = digests  # {price row: TDigest}
+
+    @classmethod
+    def of_samples(cls, columns, weight):
+        """Summary of a (len(FIELDS), n) block of samples that each cover weight seconds"""
+        present = ~np.isnan(columns)
+        values = np.where(present, columns, 0.0)
+        stats = np.empty((len(STATS), len(FIELDS)))
+        stats[0] = present.sum(axis=1)
+        stats[1] = stats[0] * weight
+        stats[2] = values.sum(axis=1) * weight
+        stats[3] = (values * values).sum(axis=1) * weight
+        stats[4] = np.where(present, columns, np.inf).min(axis=1)
+        stats[5] = np.where(present, columns, -np.inf).max(axis=1)
+        vwap = {}
+        for price, volume in VOLUMES.items():
+            paired = present[price] & present[volume]
+            volumes = columns[volume, paired] * weight
+            vwap[price] = [float(np.dot(columns[price, paired], volumes)), float(volumes.sum())]
+        digests = {row: TDigest(columns[row], weight) for row in SKETCHED}
+        return cls(stats, vwap, digests)
+
+    @classmethod
+    def merged(cls, buckets, compression=None):
+        """One summary of everything in the given buckets"""
+        stacked = np.stack([bucket.stats for bucket in buckets])
+        stats = np.empty((len(STATS), len(FIELDS)))
+        stats[:4] = stacked[:, :4].sum(axis=0)
+        stats[4] = stacked[:, 4].min(axis=0)
+        stats[5] = stacked[:, 5].max(axis=0)
+        vwap = {price: [sum(bucket.vwap[price][0] for bucket in buckets), sum(bucket.vwap[price][1] for bucket in buckets)]
+                for price in VOLUMES}
+        digests = {row: TDigest.merged([bucket.digests[row] for bucket in buckets], compression) for row in SKETCHED}
+        return cls(stats, vwap, digests)
+
+    def series(self, field):
+        """Time weighted count/mean/std/min/max of one series, buy/sell also get their VWAP and
+        percentile bands, None if the series had no values"""
+        row = FIELDS.index(field)
+        count, weight, total, squares, low, high = self.stats[:, row]
+        if not count:
+            return None
+        mean = total / weight
+        summary = {
+            "count": int(count),
+            "mean": float(mean),
+            "std": float(np.sqrt(max(squares / weight - mean * mean, 0.0))),
+            "min": float(low),
+            "max": float(high),
+        }
+        if row in VOLUMES:
+            price_volume, volume = self.vwap[row]
+            summary["vwap"] = price_volume / volume if volume else None
+            for name, q in PERCENTILES.items():
+                summary[name] = self.digests[row].quantile(q)
+        return summary
+
+    def as_dict(self):
+        """series() of every field, for the API"""
+        return {field: self.series(field) for field in FIELDS}
+
+
+class HourlySummaries:
+    """HourBuckets of one product by hour, any window is a merge of the hours it covers.
+
+    Samples are only ever added newer than the newest one taken, each counted in the hour it
+    starts in. Buckets older than the retention are dropped.
+
+    """
+
+    def __init__(self, retention=None):
+        self._retention = retention or config.HOURLY_RETENTION
+        self._starts = []  # hour start of each bucket, ascending
+        self._buckets = []
+        self.newest = None  # time of the newest sample taken
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def add(self, item, step, end=None):
+        """Adds item's samples newer than what we have, each covering step seconds.
+
+        With end only the samples that end by then are taken, so a coarser view can fill in
+        up to where a finer one starts. Returns the number of samples added.
+        """
+        index = item.time_index()
+        times = item.get_timestamps()[:index.dated]
+        lo = 0 if self.newest is None else int(np.searchsorted(times, self.newest, side="right"))
+        hi = len(times) if end is None else int(np.searchsorted(times, end - step, side="right"))
+        if hi <= lo:
+            return 0
+        times, columns = times[lo:hi], item.get_columns()[:, lo:hi]
+        hours = np.floor(times / HOUR) * HOUR
+        firsts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+        for first, last in zip(firsts, np.r_[firsts[1:], len(times)]):
+            bucket = HourBucket.of_samples(columns[:, first:last], step)
+            if self._starts and self._starts[-1] == hours[first]:
+                bucket = HourBucket.merged([self._buckets[-1], bucket], config.SKETCH_COMPRESSION)
+                self._buckets[-1] = bucket
+            else:
+                self._starts.append(float(hours[first]))
+                self._buckets.append(bucket)
+        self.newest = float(times[-1])
+        cutoff = bisect.bisect_left(self._starts, self._starts[-1] - (self._retention - 1) * HOUR)
+        del self._starts[:cutoff], self._buckets[:cutoff]
+        return hi - lo
+
+    def seed(self, day, hour, week, day_step, hour_step, week_step):
+        """Fills in from the three views, each only up to where the next finer one starts"""
+        self.add(week, week_step, end=day.time_index().first())
+        self.add(day, day_step, end=hour.time_index().first())
+        self.add(hour, hour_step)
+
+    def window(self, start=None, end=None):
+        """Merged HourBucket of the hours starting in [start, end), None if there are none"""
+        lo = 0 if start is None else bisect.bisect_left(self._starts, start)
+        hi = len(self._starts) if end is None else bisect.bisect_left(self._starts, end)
+        if hi <= lo:
+            return None
+        return HourBucket.merged(self._buckets[lo:hi], config.WINDOW_SKETCH_COMPRESSION)
+
+    def trailing(self, hours):
+        """window() of the last hours hours, counting the one in progress"""
+        if not self._starts:
+            return None
+        return self.window(self._starts[-1] - (hours - 1) * HOUR)
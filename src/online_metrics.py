@@ -0,0 +1,205 @@
+from collections import deque
+
+import numpy as np
+
+from Bazaar_Algo import SERIES_VOLUMES, Item
+from quantiles import RunningQuantile, RunningTrimmedMean
+
+# Bazaar_Algo.Item's series attributes, in api_call.FIELDS order so a column row lines up
+SERIES = ("_maxSell", "_maxBuy", "_min_buy", "_minSell", "_buy", "_sell", "_sellvolume", "_buyvolume")
+VWAP_ROWS = {SERIES.index(price): SERIES.index(volume) for price, volume in SERIES_VOLUMES.items()}
+RESUM_EVERY = 10_000  # samples added or dropped before the running sums are recomputed, bounds float drift
+
+
+class WindowSummary:
+    """The fields of Bazaar_Algo.SeriesSummary, read off a RunningWindow's running state.
+
+    Order statistics are only tracked for the series and quantiles somebody asks for, so
+    they are properties: the first read sets up the window's structure for it.
+
+    """
+
+    def __init__(self, window, row, count, total, vwap):
+        self._window = window
+        self._row = row
+        self._empty = not count
+        if self._empty:
+            count, total = 1, 1.0  # Item.flatten_and_check's [1.0]
+        self.count = count
+        self.sum = total
+        self.mean = total / count
+        self.vwap = vwap
+
+    def percentile(self, q):
+        """q quantile (0 to 1) interpolated like np.percentile"""
+        return 1.0 if self._empty else self._window.order(self._row, q).value()
+
+    @property
+    def median(self):
+        return self.percentile(0.5)
+
+    @property
+    def min(self):
+        return self.percentile(0.0)
+
+    @property
+    def max(self):
+        return self.percentile(1.0)
+
+    @property
+    def trimmed_mean(self):
+        return 1.0 if self._empty else self._window.order(self._row, "trimmed").value()
+
+
+class RunningWindow:
+    """Every series of one view (day, hour or week), kept up to date one sample at a time.
+
+    Per series it keeps the count and the sum, and for buy/sell the VWAP numerator (price *
+    volume) and denominator (volume), all O(1) to update. Medians, other quantiles and the
+    trimmed mean come from quantiles' two-heap structures, O(log n) per sample, set up per
+    series the first time they're asked for. A summary never goes back over the samples.
+
+    """
+
+    def __init__(self):
+        self._samples = deque()  # (time, column row), oldest first
+        self._count = np.zeros(len(SERIES), dtype=np.int64)
+        self._sum = np.zeros(len(SERIES))
+        self._orders = {}  # (series row, quantile or "trimmed") -> structure over that series
+        self._vwap = {row: [0.0, 0.0, 0] for row in VWAP_ROWS}  # price * volume, volume, non zero volumes
+        self._summaries = {}
+        self._changes = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def newest(self):
+        """Time of the newest sample, None while empty"""
+        return self._samples[-1][0] if self._samples else None
+
+    def apply(self, row, sign):
+        """Adds (sign 1) or takes away (sign -1) one sample's values"""
+        present = ~np.isnan(row)
+        self._count += sign * present
+        self._sum += sign * np.where(present, row, 0.0)
+        for (i, _), order in self._orders.items():
+            if not present[i]:
+                continue
+            if sign > 0:
+                order.add(float(row[i]))
+            else:
+                order.remove(float(row[i]))
+        for price, volume in VWAP_ROWS.items():
+            if present[price] and present[volume]:  # like Item.paired, only samples with both count
+                state = self._vwap[price]
+                state[0] += sign * row[price] * row[volume]
+                state[1] += sign * row[volume]
+                state[2] += sign * (row[volume] != 0)
+        self._changes += 1
+
+    def add(self, time, row):
+        """Adds a sample, returns whether it was taken.
+
+        A sample at the newest time replaces it (coflnet revises its latest bucket), older
+        ones are ignored.
+        """
+        newest = self.newest()
+        if newest is not None and time < newest:
+            return False
+        if newest == time:
+            self.apply(self._samples.pop()[1], -1)
+        self._samples.append((time, row))
+        self.apply(row, 1)
+        self._summaries.clear()
+        return True
+
+    def drop_before(self, time):
+        """Takes away the samples older than time"""
+        while self._samples and self._samples[0][0] < time:
+            self.apply(self._samples.popleft()[1], -1)
+        self._summaries.clear()
+
+    def extend(self, item):
+        """Brings the window to an api_call.Item of the same view.
+
+        Only the item's samples from our newest time on get added and only the ones older
+        than its first sample dropped, returns how many were added.
+        """
+        index = item.time_index()
+        times = item.get_timestamps()[:index.dated]
+        newest = self.newest()
+        start = 0 if newest is None else int(np.searchsorted(times, newest, side="left"))
+        columns = item.get_columns()
+        added = sum(self.add(float(times[i]), columns[:, i].copy()) for i in range(start, len(times)))
+        if len(times):
+            self.drop_before(float(times[0]))
+        if self._changes > RESUM_EVERY:
+            self.resum()
+        return added
+
+    def order(self, row, kind):
+        """RunningQuantile (kind is q) or RunningTrimmedMean (kind "trimmed") of a series, kept from now on"""
+        if (row, kind) not in self._orders:
+            order = RunningTrimmedMean() if kind == "trimmed" else RunningQuantile(kind)
+            for _, values in self._samples:
+                if not np.isnan(values[row]):
+                    order.add(float(values[row]))
+            self._orders[row, kind] = order
+        return self._orders[row, kind]
+
+    def resum(self):
+        """Recomputes the running sums from the samples in the window, order structures get rebuilt when next used"""
+        rows = np.array([row for _, row in self._samples]).reshape(-1, len(SERIES))
+        present = ~np.isnan(rows)
+        self._count = present.sum(axis=0)
+        self._sum = np.where(present, rows, 0.0).sum(axis=0)
+        for price, volume in VWAP_ROWS.items():
+            paired = present[:, price] & present[:, volume]
+            volumes = rows[paired, volume]
+            self._vwap[price] = [float(np.dot(rows[paired, price], volumes)), float(volumes.sum()),
+                                 int(np.count_nonzero(volumes))]
+        self._orders.clear()
+        self._changes = 0
+
+    def summary(self, series):
+        """WindowSummary of one series, e.g. summary("_buy"), cached until the next sample"""
+        if series not in self._summaries:
+            i = SERIES.index(series)
+            vwap = None  # None without volume, like SeriesSummary
+            if i in VWAP_ROWS:
+                numerator, volume, nonzero = self._vwap[i]
+                if nonzero:
+                    vwap = numerator / volume
+            self._summaries[series] = WindowSummary(self, i, int(self._count[i]), float(self._sum[i]), vwap)
+        return self._summaries[series]
+
+
+class WindowItem(Item):
+    """Bazaar_Algo.Item answering from a RunningWindow, so Main's formulas stay the only copy"""
+
+    def __init__(self, window):
+        super().__init__(*([[]] * len(SERIES)))
+        self._window = window
+
+    def summary(self, series):
+        return self._window.summary(series)
+
+
+class OnlineMetrics:
+    """Running day/hour/week windows of one product.
+
+    update() takes the newest (day, hour, week) histories and only adds the samples past what
+    it already has, Main.metrics_from_items(*items()) then gives build_metrics' dict without rescanning.
+
+    """
+
+    def __init__(self):
+        self.windows = (RunningWindow(), RunningWindow(), RunningWindow())
+
+    def update(self, item_result):
+        """Feeds a (day, hour, week) result in, returns the number of new samples"""
+        return sum(window.extend(item) for window, item in zip(self.windows, item_result))
+
+    def items(self):
+        """(day, hour, week) Items for Main.metrics_from_items"""
+        return tuple(WindowItem(window) for window in self.windows)
@@ -0,0 +1,212 @@
+import heapq
+import math
+from collections import Counter
+
+import numpy as np
+
+import config
+
+TRIM_SHARE = 0.05  # SeriesSummary.trimmed_mean's trim off each end
+TRIM_MIN_COUNT = 6  # fewer values than this aren't trimmed
+
+
+def trim_count(count):
+    """Values the trimmed mean leaves out at each end of count values"""
+    return int(count * TRIM_SHARE) if count >= TRIM_MIN_COUNT else 0
+
+
+class OrderSplit:
+    """A multiset of floats split into its target(n) smallest values and the rest.
+
+    The lower part is a max-heap, the upper one a min-heap, each with its running sum, so the
+    values either side of the split and the sums are O(1) and adding or removing a value is
+    O(log n). Removal is lazy: the value is counted as gone and only popped once it reaches
+    the top of its heap, a heap that is mostly gone values gets rebuilt.
+
+    """
+
+    def __init__(self, target):
+        self._target = target  # n -> how many values belong below the split
+        self._heaps = ([], [])  # lower values negated so both are min-heaps
+        self._gone = (Counter(), Counter())  # taken away values still in each heap
+        self.sizes = [0, 0]
+        self.sums = [0.0, 0.0]
+
+    def __len__(self):
+        return self.sizes[0] + self.sizes[1]
+
+    def top(self, side):
+        """Largest value below the split (side 0) or smallest above it (side 1), None if empty"""
+        if not self.sizes[side]:
+            return None
+        value = self._heaps[side][0]
+        return -value if side == 0 else value
+
+    def add(self, value):
+        side = 1 if not self.sizes[0] or value > self.top(0) else 0
+        heapq.heappush(self._heaps[side], -value if side == 0 else value)
+        self.sizes[side] += 1
+        self.sums[side] += value
+        self._balance()
+
+    def remove(self, value):
+        """Takes one copy of a value that was added away"""
+        side = 1 if not self.sizes[0] or value > self.top(0) else 0  # equal to the lower top counts as below
+        self._gone[side][value] += 1
+        self.sizes[side] -= 1
+        self.sums[side] -= value
+        if len(self._heaps[side]) > 2 * self.sizes[side] + 64:
+            self._rebuild(side)
+        self._prune(side)
+        self._balance()
+
+    def _prune(self, side):
+        """Pops gone values off the top so top() is always a live value"""
+        heap, gone = self._heaps[side], self._gone[side]
+        while heap:
+            value = -heap[0] if side == 0 else heap[0]
+            if not gone[value]:
+                return
+            gone[value] -= 1
+            if not gone[value]:
+                del gone[value]
+            heapq.heappop(heap)
+
+    def _rebuild(self, side):
+        """Drops every gone value from a heap and resums it"""
+        heap, gone = self._heaps[side], self._gone[side]
+        live = []
+        for stored in heap:
+            value = -stored if side == 0 else stored
+            if gone[value]:
+                gone[value] -= 1
+            else:
+                live.append(stored)
+        gone.clear()
+        heapq.heapify(live)
+        self._heaps[side][:] = live
+        self.sums[side] = math.fsum(live) * (-1 if side == 0 else 1)
+
+    def _move(self, side):
+        """Moves the top value of one side over to the other"""
+        stored = heapq.heappop(self._heaps[side])
+        value = -stored if side == 0 else stored
+        self.sizes[side] -= 1
+        self.sums[side] -= value
+        self._prune(side)
+        other = 1 - side
+        heapq.heappush(self._heaps[other], -value if other == 0 else value)
+        self.sizes[other] += 1
+        self.sums[other] += value
+
+    def _balance(self):
+        want = self._target(len(self))
+        while self.sizes[0] > want:
+            self._move(0)
+        while self.sizes[0] < want:
+            self._move(1)
+
+
+class RunningQuantile(OrderSplit):
+    """The q quantile of a changing multiset, interpolated like np.percentile, q=0.5 is the median"""
+
+    def __init__(self, q):
+        super().__init__(lambda n: int(math.floor(q * (n - 1))) + 1 if n else 0)
+        self.q = q
+
+    def value(self):
+        """None while empty"""
+        n = len(self)
+        if not n:
+            return None
+        position = self.q * (n - 1)
+        fraction = position - math.floor(position)
+        low = self.top(0)
+        if not fraction or not self.sizes[1]:
+            return low
+        return low * (1 - fraction) + self.top(1) * fraction
+
+
+class RunningTrimmedMean:
+    """Mean of a changing multiset without its trim_count smallest and largest values"""
+
+    def __init__(self):
+        self._low = OrderSplit(trim_count)  # the trimmed small values sit below this split
+        self._high = OrderSplit(lambda n: n - trim_count(n))  # and the large ones above this one
+
+    def __len__(self):
+        return len(self._low)
+
+    def add(self, value):
+        self._low.add(value)
+        self._high.add(value)
+
+    def remove(self, value):
+        self._low.remove(value)
+        self._high.remove(value)
+
+    def value(self):
+        """None while empty"""
+        n = len(self)
+        if not n:
+            return None
+        total = self._high.sums[0] + self._high.sums[1]
+        return (total - self._low.sums[0] - self._high.sums[1]) / (n - 2 * trim_count(n))
+
+
+class TDigest:
+    """Mergeable quantile sketch, a merging t-digest with the k1 scale function.
+
+    Values are kept as (mean, weight) centroids, about compression / 2 of them, smallest at
+    the ends so the tails stay accurate. Digests of separate samples merge into one of all of
+    them without the values, which is what lets per hour summaries answer longer windows.
+    Unlike the heaps above nothing can be taken back out.
+
+    """
+
+    def __init__(self, values=(), weights=None, compression=None):
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.ones(len(values)) if weights is None else np.broadcast_to(weights, values.shape).astype(np.float64)
+        keep = ~np.isnan(values) & (weights > 0)
+        values, weights = values[keep], weights[keep]
+        self.compression = compression or config.SKETCH_COMPRESSION
+        self.min = float(values.min()) if len(values) else None
+        self.max = float(values.max()) if len(values) else None
+        self.means, self.weights = self._compress(values, weights)
+
+    @classmethod
+    def merged(cls, digests, compression=None):
+        """One digest of everything the given ones have seen"""
+        digests = [digest for digest in digests if len(digest.means)]
+        if not digests:
+            return cls(compression=compression)
+        merged = cls(np.concatenate([digest.means for digest in digests]),
+                     np.concatenate([digest.weights for digest in digests]), compression)
+        merged.min = min(digest.min for digest in digests)  # the centroids alone would round the ends in
+        merged.max = max(digest.max for digest in digests)
+        return merged
+
+    def _compress(self, means, weights):
+        """Sorted centroids, neighbours within one unit of the scale function merged"""
+        if not len(means):
+            return means, weights
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        middle = (np.cumsum(weights) - weights / 2) / weights.sum()  # quantile at each centroid's middle
+        clusters = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * middle - 1))
+        firsts = np.flatnonzero(np.r_[True, clusters[1:] != clusters[:-1]])
+        merged_weights = np.add.reduceat(weights, firsts)
+        return np.add.reduceat(means * weights, firsts) / merged_weights, merged_weights
+
+    @property
+    def count(self):
+        """Total weight seen"""
+        return float(self.weights.sum())
+
+    def quantile(self, q):
+        """Value at quantile q (0 to 1) interpolated between centroids, None while empty"""
+        if not len(self.means):
+            return None
+        centers = np.cumsum(self.weights) - self.weights / 2
+        points = np.r_[0.0, centers, self.count]
+        return float(np.interp(q * self.count, points, np.r_[self.min, self.means, self.max]))
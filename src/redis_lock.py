@@ -0,0 +1,101 @@
+import asyncio
+import time
+import uuid
+
+import config
+
+# Only delete the lock if we still own it, otherwise we could free someone else's lease
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class RefreshLock:
+    """Short lease lock in redis so only one worker refreshes a product.
+
+    In process coalescing only helps inside one uvicorn worker, this makes the
+    other workers/containers wait for the holder instead of hitting coflnet too.
+
+    """
+
+    def __init__(self, lease_ms=None, wait_ms=None, poll_ms=None):
+        self._lease_ms = lease_ms or config.REFRESH_LOCK_LEASE_MS
+        self._wait_ms = wait_ms or config.REFRESH_LOCK_WAIT_MS
+        self._poll_ms = poll_ms or config.REFRESH_LOCK_POLL_MS
+        self._acquired = 0
+        self._contended = 0
+        self._waits_served = 0
+        self._waits_timed_out = 0
+        self._lost_leases = 0
+
+    def lock_key(self, product_id):
+        """Redis key of the lock for a product"""
+        return f"lock:refresh:{product_id}"
+
+    async def acquire(self, client, product_id):
+        """SET NX PX, returns our token if we got the lock or None if someone else has it"""
+        token = uuid.uuid4().hex
+        if await client.set(self.lock_key(product_id), token, nx=True, px=self._lease_ms):
+            self._acquired += 1
+            return token
+        self._contended += 1
+        return None
+
+    async def release(self, client, product_id, token):
+        """Frees the lock if the lease is still ours"""
+        released = await client.eval(RELEASE_SCRIPT, 1, self.lock_key(product_id), token)
+        if not released:
+            self._lost_leases += 1  # lease ran out before we finished, raise REFRESH_LOCK_LEASE_MS
+        return bool(released)
+
+    async def wait_for(self, client, key):
+        """Polls key while another worker refreshes it, returns the value or None after wait_ms"""
+        deadline = time.monotonic() + self._wait_ms / 1000
+        while time.monotonic() < deadline:
+            value = await client.get(key)
+            if value:
+                self._waits_served += 1
+                return value
+            await asyncio.sleep(self._poll_ms / 1000)
+        self._waits_timed_out += 1
+        return None
+
+    def stats(self):
+        """Lock counters for /stats"""
+        return {
+            "lease_ms": self._lease_ms,
+            "acquired": self._acquired,
+            "contended": self._contended,
+            "waits_served": self._waits_served,
+            "waits_timed_out": self._waits_timed_out,
+            "lost_leases": self._lost_leases,
+        }
+
+
+# Quick check against a local redis-server: REDIS_URL=redis://localhost python redis_lock.py
+if __name__ == "__main__":
+    from redis.asyncio import Redis
+
+    async def worker(lock, client, name):
+        token = await lock.acquire(client, "TEST_ITEM")
+        if token is None:
+            value = await lock.wait_for(client, "TEST_ITEM")
+            print(f"{name} waited and got {value}")
+            return
+        print(f"{name} holds the lock, refreshing")
+        await asyncio.sleep(0.2)
+        await client.set("TEST_ITEM", name, ex=5)
+        print(f"{name} released: {await lock.release(client, 'TEST_ITEM', token)}")
+
+    async def run():
+        client = Redis.from_url(config.REDIS_URL)
+        await client.delete("TEST_ITEM", "lock:refresh:TEST_ITEM")
+        lock = RefreshLock(lease_ms=2000, wait_ms=1000)
+        await asyncio.gather(*(worker(lock, client, f"worker-{i}") for i in range(5)))
+        print(lock.stats())
+        await client.aclose()
+
+    asyncio.run(run())
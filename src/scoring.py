@@ -0,0 +1,200 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+
+
+def score_chunk(chunk, parsed=False):
+    """Worker side of score_batch: scores (search, raw_result) pairs, a failure comes back as its exception.
+
+    With parsed the pairs hold (day, hour, week) Items already, e.g. from the HistoryStore.
+    The whole chunk goes through market_algo's array version of the scoring in one go.
+    """
+    from api_call import Search
+    from market_algo import score_results
+    parser = Search()
+    searches, item_results, failed = [], [], {}
+    for i, (search, result) in enumerate(chunk):
+        searches.append(search)
+        try:
+            item_results.append(result if parsed else parser.parse_results(result))
+        except Exception as e:
+            item_results.append(None)
+            failed[i] = e
+
+    results = score_results(item_results, searches)
+    return [failed.get(i, result) for i, result in enumerate(results)]
+
+
+class ScoringExecutor:
+    """Runs the CPU heavy metrics/scoring code off the event loop.
+
+    The thread pool caps how many jobs run at once and the semaphore caps how many
+    can pile up, so a burst of misses waits here instead of growing an unbounded queue.
+
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, chunk_size=None):
+        self._max_workers = max_workers or self.default_workers()
+        self._max_pending = max_pending or config.SCORING_MAX_PENDING
+        self._chunk_size = chunk_size or config.SCORING_CHUNK_SIZE
+        self._executor = self.make_executor()
+        self._slots = asyncio.Semaphore(self._max_pending)
+        self._pending = 0
+        self._completed = 0
+        self._job_seconds = 0.0
+        self._restarts = 0
+        self._batches = 0
+        self._batch_items = 0
+        self._batch_seconds = 0.0
+
+    def default_workers(self):
+        return config.SCORING_THREADS
+
+    def make_executor(self):
+        return ThreadPoolExecutor(self._max_workers, thread_name_prefix="scoring")
+
+    async def run(self, func, *args):
+        """Awaits func(*args) from the pool, func and args have to be picklable for processes"""
+        async with self._slots:
+            self._pending += 1
+            started = time.perf_counter()
+            executor = self._executor
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenExecutor:
+                # a worker died (oom kill etc.), the pool refuses all work after that so swap in a new one.
+                # every job that was on it lands here, only the first one finds it still current and replaces it
+                if self._executor is executor:
+                    print("Scoring pool broken, restarting")
+                    executor.shutdown(wait=False)
+                    self._executor = self.make_executor()
+                    self._restarts += 1
+                raise
+            finally:
+                self._pending -= 1
+                self._completed += 1
+                self._job_seconds += time.perf_counter() - started
+
+    def chunk_size(self, count):
+        """Enough chunks to keep every worker busy, small enough to keep each task's IPC small"""
+        return max(1, min(self._chunk_size, math.ceil(count / (self._max_workers * 4))))
+
+    async def score_batch(self, items, chunk_size=None, parsed=False):
+        """Scores a list of (search, raw_result) pairs in chunks.
+
+        raw_result is what Search.search_item_async(parse=False) returns, or with parsed the
+        (day, hour, week) Items. Results come back in the same order as main_algo dicts (False
+        if not found), failures as exceptions.
+        """
+        items = list(items)
+        if not items:
+            return []
+        started = time.perf_counter()
+        size = chunk_size or self.chunk_size(len(items))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        results = await asyncio.gather(*(self.run(score_chunk, chunk, parsed) for chunk in chunks))
+        self._batches += 1
+        self._batch_items += len(items)
+        self._batch_seconds += time.perf_counter() - started
+        return [result for chunk in results for result in chunk]
+
+    def shutdown(self):
+        """Waits for running jobs and stops the workers, blocks so the app runs it in a thread"""
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        """Executor counters for /stats"""
+        return {
+            "backend": "thread",
+            "workers": self._max_workers,
+            "max_pending": self._max_pending,
+            "pending": self._pending,
+            "completed": self._completed,
+            "job_seconds": self._job_seconds,
+            "restarts": self._restarts,
+            "batches": self._batches,
+            "batch_items": self._batch_items,
+            "batch_items_per_second": self._batch_items / self._batch_seconds if self._batch_seconds else None,
+        }
+
+
+class ScoringPool(ScoringExecutor):
+    """Same as ScoringExecutor but on worker processes, so scoring isn't stuck behind the GIL.
+
+    Used for recomputing many items at once, throughput grows with the number of cores.
+
+    """
+
+    def default_workers(self):
+        return config.SCORING_PROCESSES or os.cpu_count() or 1
+
+    def make_executor(self):
+        # spawn, forking a process that already runs an event loop and threads isn't safe
+        return ProcessPoolExecutor(self._max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def stats(self):
+        stats = super().stats()
+        stats["backend"] = "process"
+        return stats
+
+
+def make_scoring():
+    """The scoring backend picked by SCORING_BACKEND"""
+    if config.SCORING_BACKEND == "process":
+        return ScoringPool()
+    return ScoringExecutor()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a sleeping task, i.e. how long something blocked it."""
+
+    def __init__(self, interval=None):
+        self._interval = interval or config.LOOP_LAG_INTERVAL
+        self._task = None
+        self._samples = 0
+        self._last_ms = 0.0
+        self._avg_ms = 0.0
+        self._max_ms = 0.0
+        self._over_5ms = 0
+
+    def record(self, lag_ms):
+        """Adds one lag sample, avg is an ewma so it follows recent load"""
+        self._samples += 1
+        self._last_ms = lag_ms
+        self._avg_ms = lag_ms if self._samples == 1 else 0.9 * self._avg_ms + 0.1 * lag_ms
+        self._max_ms = max(self._max_ms, lag_ms)
+        if lag_ms > 5:
+            self._over_5ms += 1
+
+    async def run(self):
+        """Sleeps interval seconds over and over and records how late it woke up"""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self._interval)
+            self.record(max(0.0, (time.perf_counter() - started - self._interval) * 1000))
+
+    def start(self):
+        """Starts sampling in the background"""
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stops sampling"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self):
+        """Lag numbers in milliseconds for /stats"""
+        return {
+            "samples": self._samples,
+            "last_ms": self._last_ms,
+            "avg_ms": self._avg_ms,
+            "max_ms": self._max_ms,
+            "samples_over_5ms": self._over_5ms,
+        }
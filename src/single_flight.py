@@ -0,0 +1,104 @@
+import asyncio
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one.
+
+    The first caller for a key runs the work, everyone that shows up while it is
+    still running awaits the same future instead of starting their own.
+
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._batches = set()  # do_many tasks, kept so they aren't garbage collected
+        self._calls = 0
+        self._executions = 0
+        self._coalesced = 0
+        self._errors = 0
+
+    def _done(self, key, future):
+        """Drops the finished future so the next call starts fresh"""
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled() and future.exception() is not None:
+            self._errors += 1
+
+    async def do(self, key, func):
+        """Runs func() once per key at a time and returns its result to every waiter"""
+        self._calls += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._coalesced += 1
+        else:
+            self._executions += 1
+            future = asyncio.ensure_future(func())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+
+        # shield so one caller disconnecting doesn't cancel the work for the others
+        return await asyncio.shield(future)
+
+    async def do_many(self, keys, func):
+        """do() for many keys at once, returns {key: result or exception} and never raises for a key.
+
+        Keys already in flight join that work, func(new_keys) runs once for the rest and
+        returns {key: result or exception}, so they can be worked on together.
+        """
+        loop = asyncio.get_running_loop()
+        futures, new = {}, []
+        for key in keys:
+            self._calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._coalesced += 1
+            else:
+                self._executions += 1
+                future = loop.create_future()
+                self._in_flight[key] = future
+                future.add_done_callback(lambda f, key=key: self._done(key, f))
+                new.append(key)
+            futures[key] = future
+        if new:
+            task = asyncio.ensure_future(self._settle(new, func, futures))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+        results = await asyncio.gather(*(asyncio.shield(future) for future in futures.values()), return_exceptions=True)
+        return dict(zip(futures, results))
+
+    async def _settle(self, keys, func, futures):
+        """Runs func for a do_many batch and hands each key's future its result"""
+        try:
+            results = await func(keys)
+        except asyncio.CancelledError:
+            for key in keys:
+                futures[key].cancel()
+            raise
+        except Exception as e:
+            results = dict.fromkeys(keys, e)
+        for key in keys:
+            future, result = futures[key], results.get(key)
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def stop(self):
+        """Cancels whatever is still running, used on shutdown since callers can't cancel shielded work"""
+        futures = list(self._in_flight.values()) + list(self._batches)
+        for future in futures:
+            future.cancel()
+        await asyncio.gather(*futures, return_exceptions=True)
+
+    def stats(self):
+        """Fetch counters, coalesced is how many calls didn't have to hit coflnet"""
+        return {
+            "calls": self._calls,
+            "executions": self._executions,
+            "coalesced": self._coalesced,
+            "errors": self._errors,
+            "in_flight": len(self._in_flight),
+        }
@@ -1,14 +1,97 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException, Request
 from Bazaar_Algo import Main
+from api_call import HORIZONS
 from pydantic import BaseModel
 from dyn_search_arr import DynSearchList
-from typing import List
+from typing import Dict, List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 
-# Caching Imports Below:
-from redis.asyncio import Redis
+import config
+from client_tracking import TrackingCache
+from history_store import HistoryStore
+from http_client import CoflClient
+from local_cache import Invalidator, LocalCache
+from prefetch import PrefetchScheduler
+from redis_lock import RefreshLock
+from redis_pool import RedisPool
+from refresh_queue import RefreshQueue
+from scoring import LoopLagMonitor, make_scoring
+from search_func import product_ids
+from signal_cache import CacheEntry, SignalCache, signal_key
+from single_flight import SingleFlight
+from time_index import HOUR
+from ttl_policy import adaptive_ttl
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Things that live as long as the app, shared by every request"""
+    app.state.cofl_client = CoflClient()  # pooled keep-alive connections to coflnet
+    app.state.redis = RedisPool()  # one redis pool for every handler, health checked in the background
+    app.state.redis.start()
+    app.state.scoring = make_scoring()  # metrics/scoring CPU work off the event loop (and the GIL)
+    app.state.loop_lag = LoopLagMonitor()
+    app.state.loop_lag.start()
+    app.state.single_flight = SingleFlight()  # one upstream fetch per product at a time
+    app.state.history_store = HistoryStore() if config.HISTORY_STORE_ENABLED else None  # refreshes fetch only the last hour
+    app.state.refresh_lock = RefreshLock()  # one refresh per product across workers
+    await start_local_caching(app)  # hot products without a redis round trip
+    app.state.signal_cache = SignalCache(  # stale-while-revalidate entries in redis
+        local_cache=app.state.local_cache, invalidator=app.state.invalidator, tracker=app.state.tracker
+    )
+    app.state.background_tasks = set()
+    app.state.refresh_queue = RefreshQueue(product_ids())  # staleness x popularity x volatility
+    app.state.prefetcher = None
+    if config.PREFETCH_ENABLED:
+        app.state.prefetcher = make_prefetcher(app, app.state.redis.client)
+        app.state.prefetcher.start()
+    try:
+        yield
+    finally:
+        if app.state.prefetcher is not None:
+            await app.state.prefetcher.stop()
+        for task in app.state.background_tasks:
+            task.cancel()
+        await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+        await app.state.single_flight.stop()
+        await stop_local_caching(app)
+        await app.state.redis.stop()
+        await app.state.cofl_client.aclose()
+        await app.state.loop_lag.stop()
+        await asyncio.to_thread(app.state.scoring.shutdown)  # waits on the workers, not on the loop
+
+
+async def start_local_caching(app):
+    """Redis client side caching if the server supports it, our own LRU + pub/sub otherwise"""
+    app.state.tracker = app.state.local_cache = app.state.invalidator = None
+    if config.REDIS_CLIENT_TRACKING:
+        tracker = TrackingCache()
+        try:
+            await tracker.start()
+            app.state.tracker = tracker
+            return
+        except Exception as e:
+            print(f"Client tracking unavailable ({e}), using pub/sub invalidation")
+            await tracker.stop()
 
-app = FastAPI()
+    app.state.local_cache = LocalCache()
+    app.state.invalidator = Invalidator(app.state.local_cache)
+    app.state.invalidator.start(app.state.redis.client)
+
+
+async def stop_local_caching(app):
+    """Stops whichever of the two start_local_caching picked"""
+    if app.state.tracker is not None:
+        await app.state.tracker.stop()
+    if app.state.invalidator is not None:
+        await app.state.invalidator.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS handling.
 origins = [  # Used this to test if the apis work within the frontend
@@ -58,36 +141,355 @@ class InvestmentSignal(BaseModel):  # data validation for the investment signal
     metrics: Metrics
 
 
+async def refresh_signal(product_id, app, stale=None, wait=True):
+    """Recomputes a product unless another worker already is, then we serve stale or wait for its result.
+
+    This is the work single_flight shares between callers and it outlives the one that started
+    it, so it uses the app's pool client and its own Main, nothing of that caller's.
+    """
+    client = app.state.redis.client
+    lock = app.state.refresh_lock
+    token = await lock.acquire(client, product_id)
+    if token is None:
+        if stale is not None or not wait:
+            return stale  # someone else is refreshing, keep serving the old value
+        cache = await lock.wait_for(client, signal_key(product_id))
+        if cache:
+            return InvestmentSignal.parse_raw(CacheEntry.decode(cache).value)
+        print("Refresh lock wait timed out, computing anyway")  # holder is slow or died
+        token = await lock.acquire(client, product_id)  # take it over if the old lease ran out
+
+    try:
+        return await compute_signal(product_id, app, client)
+    finally:
+        if token is not None:
+            await lock.release(client, product_id, token)
+
+
+async def refresh_signals(product_ids, app, wait=True):
+    """refresh_signal for many products, returns {product_id: signal, None or exception}.
+
+    The products we get the lock for are computed together by compute_signals, the ones another
+    worker is on are waited for like refresh_signal does, or left as None without wait.
+    """
+    client = app.state.redis.client
+    lock = app.state.refresh_lock
+    tokens = await asyncio.gather(*(lock.acquire(client, product_id) for product_id in product_ids),
+                                  return_exceptions=True)
+    results, held, busy = {}, {}, []
+    for product_id, token in zip(product_ids, tokens):
+        if isinstance(token, BaseException):
+            results[product_id] = token
+        elif token is None:
+            busy.append(product_id)
+        else:
+            held[product_id] = token
+
+    try:
+        results.update(await compute_signals(list(held), app, client))
+    finally:
+        await asyncio.gather(*(lock.release(client, product_id, token) for product_id, token in held.items()),
+                             return_exceptions=True)
+    if wait:
+        waited = await asyncio.gather(*(refresh_signal(product_id, app) for product_id in busy), return_exceptions=True)
+        results.update(zip(busy, waited))
+    else:
+        results.update(dict.fromkeys(busy))  # someone else is refreshing them
+    return results
+
+
+async def compute_signal(product_id, app, client):
+    """Runs the algo for a cache miss and stores the result"""
+    started = time.monotonic()
+    returned_dict = await Main().main_algo_async(  # the 3 api calls go out at once, or only the hour one with the store
+        product_id, app.state.cofl_client, app.state.scoring, app.state.history_store
+    )
+    delta = time.monotonic() - started  # recompute cost, expensive items get refreshed a bit earlier
+    return await store_signal(product_id, returned_dict, app, client, delta)
+
+
+async def compute_signals(product_ids, app, client):
+    """compute_signal for many products, returns {product_id: signal or exception}.
+
+    The histories are fetched concurrently and all of them are scored by one
+    ScoringExecutor.score_batch, i.e. market_algo's array version of the algo spread over the
+    scoring workers. OnlineMetrics aren't used here, the arrays give the same numbers.
+    """
+    if not product_ids:
+        return {}
+    started = time.monotonic()
+    store = app.state.history_store
+    slots = asyncio.Semaphore(config.BATCH_CONCURRENCY)  # a cold batch shouldn't take the whole coflnet pool
+
+    async def fetch(product_id):
+        async with slots:
+            return await Main().fetch_history_async(product_id, app.state.cofl_client, store)
+
+    fetched = await asyncio.gather(*(fetch(product_id) for product_id in product_ids), return_exceptions=True)
+    results, ready = {}, []
+    for product_id, history in zip(product_ids, fetched):
+        if isinstance(history, BaseException):
+            results[product_id] = history
+        else:
+            ready.append((product_id, history))
+    scored = await app.state.scoring.score_batch(ready, parsed=store is not None)
+    delta = (time.monotonic() - started) / len(product_ids)  # each product's share of the batch
+
+    async def save(product_id, returned_dict):
+        if isinstance(returned_dict, BaseException):
+            raise returned_dict
+        return await store_signal(product_id, returned_dict, app, client, delta)
+
+    computed = [product_id for product_id, _ in ready]
+    saved = await asyncio.gather(*(save(*pair) for pair in zip(computed, scored)), return_exceptions=True)
+    results.update(zip(computed, saved))
+    return results
+
+
+async def store_signal(product_id, returned_dict, app, client, delta):
+    """Validates an algo result and caches it, delta is what computing it took"""
+    if not returned_dict:
+        raise InvalidSearch(product_id)
+
+    metrics_inst = Metrics(**returned_dict['metrics']) #Debugging if way more users, this returns the full result of the backend
+    investment_signal = InvestmentSignal(Signal=returned_dict["Signal"], metrics=metrics_inst) #Set investment signal as the api result
+    ttl = adaptive_ttl(returned_dict['metrics'])  # calm items stay cached longer, fast movers stay fresh
+    await app.state.signal_cache.set(client, signal_key(product_id), investment_signal.json(), ttl, delta) #Add to the redis, stale after the ttl
+    app.state.refresh_queue.record_refresh(product_id, metrics_inst.volatility)
+    return investment_signal # Return the result
+
+
+async def background_refresh(app, product_id, stale):
+    """Refreshes a stale entry after the request already got the old value"""
+    try:
+        await app.state.single_flight.do(product_id, lambda: refresh_signal(product_id, app, stale=stale))
+    except Exception as e:
+        print(f"Background refresh of {product_id} failed: {e}")
+
+
+def schedule_refresh(app, product_id, stale):
+    """Starts a background refresh, the task is kept on the app so it isn't garbage collected"""
+    task = asyncio.create_task(background_refresh(app, product_id, stale))
+    app.state.background_tasks.add(task)
+    task.add_done_callback(app.state.background_tasks.discard)
+
+
+async def prefetch_is_due(app, client, product_id):
+    """A product needs prefetching if it has no entry or goes stale soon"""
+    entry = await app.state.signal_cache.peek(client, signal_key(product_id))
+    return entry is None or not entry.is_fresh(time.time() + config.PREFETCH_LEAD_SECONDS)
+
+
+async def prefetch_refresh(app, product_ids):
+    """Refreshes a batch for the prefetcher, products another worker is already on are skipped.
+
+    Skipped products come back as None, so this runs under its own single flight keys: a user
+    miss joining it would be handed that None instead of a signal. A miss that shows up while
+    the prefetch holds the refresh lock waits for its result through the lock instead.
+    """
+    keys = {("prefetch", product_id): product_id for product_id in product_ids}
+
+    async def refresh(batch):
+        results = await refresh_signals([keys[key] for key in batch], app, wait=False)
+        return {("prefetch", product_id): result for product_id, result in results.items()}
+
+    results = await app.state.single_flight.do_many(keys, refresh)
+    return {keys[key]: result for key, result in results.items()}
+
+
+def serve_cached(app, product_id, entry):
+    """Signal from a cache entry, stale or early-picked entries also get a background refresh"""
+    investment_signal = InvestmentSignal.parse_raw(entry.value)
+    if not app.state.signal_cache.needs_refresh(entry):
+        print("Cache exists") # If there is a cache we return the cache result
+    else:
+        print("Cache stale, refreshing in the background")  # stale or picked for early refresh
+        schedule_refresh(app, product_id, investment_signal)
+    return investment_signal
+
+
+async def serve_missing(app, product_id):
+    """Computes a cache miss, concurrent misses for the same product wait on the first one instead of calling coflnet again"""
+    print("Cache Miss")
+    return await app.state.single_flight.do(product_id, lambda: refresh_signal(product_id, app))
+
+
+async def serve_missing_many(app, product_ids):
+    """serve_missing for many products, returns {product_id: signal or exception}.
+
+    Misses nobody is computing yet are fetched together and scored in one batch.
+    """
+    print("Cache Miss")
+    return await app.state.single_flight.do_many(product_ids, lambda keys: refresh_signals(keys, app))
+
+
+def refresh_cost(app, product_id):
+    """Upstream requests the next refresh of a product takes, just the hour call if the history store can extend it"""
+    store = app.state.history_store
+    if store is not None and store.incremental(product_id):
+        return 1
+    return 1 if config.SINGLE_CALL_MODE else len(HORIZONS)
+
+
+def make_prefetcher(app, client):
+    """Background walk over every product so users mostly get cache hits"""
+    return PrefetchScheduler(
+        app.state.refresh_queue,
+        lambda product_id: prefetch_is_due(app, client, product_id),
+        lambda product_ids: prefetch_refresh(app, product_ids),
+        cost_per_refresh=1 if config.SINGLE_CALL_MODE else len(HORIZONS),
+        refresh_cost=lambda product_id: refresh_cost(app, product_id),
+    )
+
+
 @app.get("/items/", response_model=InvestmentSignal)
-async def get_item_metrics(search_term: str):
+async def get_item_metrics(search_term: str, request: Request):
     if not search_term:  # Raise exception that search term is not there. (This should never happen)
         raise HTTPException(status_code=400, detail="Search term is required.")
     search = Main()  # Init API and search function
 
-    client = Redis.from_url("redis://redis")  # Open Redis pool
+    client = request.app.state.redis.client  # shared pool, no connect/ping per request
     try:
-        print(f"Connection Pool Open! {await client.ping()}")
+        product_id = search.search_function.product_id(search_term)  # "Wheat ", "wheat" and "WHEAT" share one entry
+        if product_id is None:
+            raise InvalidSearch(search_term)
+        request.app.state.refresh_queue.record_hit(product_id)  # popular items get prefetched more often
 
-        cache = await client.get(search_term)  # Wait search term result
-        if cache:
-            print("Cache exists") # If there is a cache we return the cache result
-            return InvestmentSignal.parse_raw(cache)
-        else:
-            print("Cache Miss")
-            returned_dict = search.main_algo(search_term)  # If no cache, search the item result which calls the API
-            if not returned_dict:
-                raise HTTPException(status_code=404, detail="Item not found...")
-
-            metrics_inst = Metrics(**returned_dict['metrics']) #Debugging if way more users, this returns the full result of the backend
-            investment_signal = InvestmentSignal(Signal=returned_dict["Signal"], metrics=metrics_inst) #Set investment signal as the api result
-            await client.set(search_term, investment_signal.json(), ex=3600) #Add to the redis, will be removed in 1 hour
-            return investment_signal # Return the result
+        entry = await request.app.state.signal_cache.get(client, signal_key(product_id))  # Wait product result
+        if entry:
+            return serve_cached(request.app, product_id, entry)
+        return await serve_missing(request.app, product_id)
     except InvalidSearch:
         raise HTTPException(status_code=404, detail="Item not found...")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        await client.aclose() #close the redis instance.
+
+
+class BatchRequest(BaseModel):
+    search_terms: List[str]  # names or product ids, same as /items/
+
+
+class BatchError(BaseModel):
+    status_code: int
+    detail: str
+
+
+class BatchResponse(BaseModel):  # keyed by the search term as it was sent
+    results: Dict[str, InvestmentSignal]
+    errors: Dict[str, BatchError]
+
+
+def batch_error(e):
+    """What /items/ would have answered for this exception"""
+    if isinstance(e, InvalidSearch):
+        return BatchError(status_code=404, detail="Item not found...")
+    return BatchError(status_code=500, detail=str(e))
+
+
+@app.post("/items/batch", response_model=BatchResponse)
+async def get_items_batch(batch: BatchRequest, request: Request):
+    """Many /items/ lookups in one call: one MGET for the cached ones, misses fetched concurrently and scored as one batch"""
+    search_terms = list(dict.fromkeys(batch.search_terms))
+    if not search_terms:
+        raise HTTPException(status_code=400, detail="Search terms are required.")
+    if len(search_terms) > config.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {config.BATCH_MAX_ITEMS} search terms per batch.")
+    app = request.app
+    search = Main()
+    client = app.state.redis.client
+
+    results, errors, term_products = {}, {}, {}
+    for search_term in search_terms:
+        product_id = search.search_function.product_id(search_term) if search_term else None
+        if product_id is None:
+            errors[search_term] = batch_error(InvalidSearch(search_term))
+        else:
+            term_products[search_term] = product_id
+    wanted = list(dict.fromkeys(term_products.values()))  # "wheat" and "WHEAT" are one lookup
+    for product_id in wanted:
+        app.state.refresh_queue.record_hit(product_id)
+
+    try:
+        entries = await app.state.signal_cache.get_many(client, [signal_key(product_id) for product_id in wanted])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    signals, missing = {}, []
+    for product_id in wanted:
+        entry = entries[signal_key(product_id)]
+        if entry is None:
+            missing.append(product_id)
+            continue
+        try:
+            signals[product_id] = serve_cached(app, product_id, entry)
+        except Exception as e:
+            signals[product_id] = e
+
+    if missing:
+        signals.update(await serve_missing_many(app, missing))
+
+    for search_term, product_id in term_products.items():
+        result = signals[product_id]
+        if isinstance(result, BaseException):
+            errors[search_term] = batch_error(result)
+        else:
+            results[search_term] = result
+    return BatchResponse(results=results, errors=errors)
+
+
+class SeriesWindow(BaseModel):  # HourBucket.series
+    count: int
+    mean: float
+    std: float
+    min: float
+    max: float
+    vwap: Optional[float] = None  # buy and sell only
+    p5: Optional[float] = None
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+
+
+class WindowResponse(BaseModel):
+    product_id: str
+    start: float  # epoch seconds, the first hour merged
+    end: float
+    series: Dict[str, Optional[SeriesWindow]]  # None where coflnet had no values
+
+
+@app.get("/items/window", response_model=WindowResponse)
+async def get_item_window(search_term: str, request: Request, hours: int = 24):
+    """Time weighted stats and percentile bands of every series over the last hours hours.
+
+    Merged from the history store's per hour summaries, so it is as fresh as the product's last
+    refresh. A product the store doesn't have yet gets refreshed first, through the same single
+    flight and refresh lock as /items/. If another worker holds the lock this one's store stays
+    empty for now and the answer is a 503 to try again.
+    """
+    store = request.app.state.history_store
+    if store is None or not store.hourly:
+        raise HTTPException(status_code=404, detail="Hourly summaries are turned off.")
+    if not 1 <= hours <= config.HOURLY_RETENTION:
+        raise HTTPException(status_code=400, detail=f"hours must be between 1 and {config.HOURLY_RETENTION}.")
+    product_id = Main().search_function.product_id(search_term)
+    if product_id is None:
+        raise HTTPException(status_code=404, detail="Item not found...")
+
+    end = time.time()
+    start = end - end % HOUR - (hours - 1) * HOUR  # the hour in progress counts as one
+    if not store.summarized(product_id):
+        try:
+            await serve_missing(request.app, product_id)  # the refresh fetches through the store
+        except InvalidSearch:
+            raise HTTPException(status_code=404, detail="Item not found...")
+        except Exception as e:
+            if not store.summarized(product_id):  # the history may have come in even if the signal failed
+                raise HTTPException(status_code=500, detail=str(e))
+        if not store.summarized(product_id):
+            raise HTTPException(status_code=503, detail="History for this item is being fetched, try again shortly.")
+    bucket = store.window(product_id, start)
+    if bucket is None:
+        raise HTTPException(status_code=404, detail="No history for this item in that window.")
+    return WindowResponse(product_id=product_id, start=start, end=end, series=bucket.as_dict())
 
 
 class PossibleItem(BaseModel):
@@ -105,6 +507,32 @@ async def dyn_search_list():
     except InvalidSearch:
         raise HTTPException(status_code=405, detail='List not found!')
 
+
+@app.get("/stats")
+async def get_stats(request: Request):
+    """Internal numbers used to size the pools"""
+    return {
+        "coflnet_pool": request.app.state.cofl_client.stats(),
+        "redis_pool": request.app.state.redis.stats(),
+        "scoring": request.app.state.scoring.stats(),
+        "event_loop": request.app.state.loop_lag.stats(),
+        "fetches": request.app.state.single_flight.stats(),
+        "history_store": request.app.state.history_store.stats() if request.app.state.history_store else None,
+        "refresh_lock": request.app.state.refresh_lock.stats(),
+        "signal_cache": request.app.state.signal_cache.stats(),
+        "local_cache": request.app.state.local_cache.stats() if request.app.state.local_cache else None,
+        "client_tracking": request.app.state.tracker.stats() if request.app.state.tracker else None,
+        "background_refreshes": len(request.app.state.background_tasks),
+        "prefetch": request.app.state.prefetcher.stats() if request.app.state.prefetcher else None,
+    }
+
+
+@app.get("/debug/refresh_queue")
+async def get_refresh_queue(request: Request, limit: int = 50):
+    """Most overdue products first, with their refresh intervals"""
+    return request.app.state.refresh_queue.snapshot(limit)
+
+
 @app.get("/version")
 async def get_curr_vers():
     try:
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TREE = os.getenv("BAZAAR_TREE", "src")  # src or docker/src, the modules import each other flat like uvicorn runs them
+
+sys.path.insert(0, os.path.join(ROOT, TREE))
+
+# a database of its own, the redis tests delete the keys they made but never flush
+REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+
+
+class Clock:
+    """Stands in for time.time() in history_store, tests move it forward by hand"""
+
+    def __init__(self, now):
+        self.now = now
+
+
+@pytest.fixture
+def market():
+    from synthetic import Market
+    return Market()
+
+
+@pytest.fixture
+def clock(monkeypatch, market):
+    """Starts a week into the market's history, so the first fetch has a full week behind it"""
+    import history_store
+    clock = Clock(market.start + 8 * 86400)
+    monkeypatch.setattr(history_store.time, "time", lambda: clock.now)
+    return clock
+
+
+@pytest.fixture
+def redis_url():
+    """TEST_REDIS_URL if a redis-server answers there, the test is skipped otherwise"""
+    from redis import Redis
+    from redis.exceptions import RedisError
+    client = Redis.from_url(REDIS_URL, socket_connect_timeout=0.5)
+    try:
+        client.ping()
+    except (RedisError, OSError):
+        pytest.skip(f"no redis-server at {REDIS_URL}")
+    finally:
+        client.close()
+    return REDIS_URL
+
+
+@pytest.fixture
+def redis_run(redis_url):
+    """Runs an async test(client, prefix) against a fresh client, deleting the prefix's keys after"""
+    import uuid
+    from redis.asyncio import Redis
+
+    def run(test):
+        async def main():
+            client, prefix = Redis.from_url(redis_url), f"test-{uuid.uuid4().hex}"
+            try:
+                await test(client, prefix)
+            finally:
+                keys = [key async for key in client.scan_iter(f"*{prefix}*")]
+                if keys:
+                    await client.delete(*keys)
+                await client.aclose()
+        asyncio.run(main())
+
+    return run
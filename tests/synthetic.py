@@ -0,0 +1,127 @@
+"""Made up coflnet history for the tests, shaped like the /history/{horizon} responses"""
+import calendar
+import json
+import time
+
+import numpy as np
+
+FIELDS = ("maxSell", "maxBuy", "minBuy", "minSell", "buy", "sell", "sellVolume", "buyVolume")
+STEPS = {"hour": 60, "day": 300, "week": 7200}
+SPANS = {"hour": 3600, "day": 86400, "week": 604800}
+
+
+def stamp(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+
+def records(rng, count, start=1_790_000_000, step=300, scale=100.0, volume_scale=1000.0, gaps=0.0):
+    """count records step seconds apart, oldest first.
+
+    With gaps, about that share of values is left out (None), another share isn't a number and
+    some records miss a field altogether, like coflnet does now and then.
+    """
+    out = []
+    for i in range(count):
+        price = scale * (1 + rng.uniform(-0.3, 0.3))
+        record = {"maxBuy": price * 1.1, "minBuy": price * 0.9, "maxSell": price * 1.15, "minSell": price * 0.95,
+                  "buy": price, "sell": price * rng.uniform(0.9, 1.2),
+                  "sellVolume": rng.uniform(0, volume_scale), "buyVolume": rng.uniform(0, volume_scale),
+                  "timestamp": stamp(start + i * step)}
+        for field in FIELDS:
+            roll = rng.random()
+            if roll < gaps:
+                record[field] = None
+            elif roll < 1.5 * gaps:
+                record[field] = "n/a"
+            elif roll < 1.75 * gaps:
+                del record[field]
+        out.append(record)
+    return out
+
+
+def product(rng, gaps=0.0, sizes=None):
+    """(day, hour, week) record lists of one product at a random price and volume scale"""
+    scale, volume_scale = 10 ** rng.uniform(0, 7), 10 ** rng.uniform(0, 6)
+    sizes = sizes or (rng.randint(1, 300), rng.randint(1, 70), rng.randint(1, 90))
+    return tuple(records(rng, count, step=STEPS[horizon], scale=scale, volume_scale=volume_scale, gaps=gaps)
+                 for count, horizon in zip(sizes, ("day", "hour", "week")))
+
+
+def list_item(history):
+    """Bazaar_Algo.Item over plain lists in the records' own order, the way api_call handed them over before the arrays"""
+    from Bazaar_Algo import Item
+    return Item(*[[record.get(field) for record in history] for field in FIELDS])
+
+
+def raw(histories):
+    """The product's bodies as Search.search_item_async(parse=False) returns them"""
+    return tuple(json.dumps(history).encode() for history in histories)
+
+
+class Market:
+    """A minute by minute price walk that answers like coflnet's history endpoints at any time"""
+
+    AGGREGATES = {"maxBuy": np.max, "maxSell": np.max, "minBuy": np.min, "minSell": np.min}
+
+    def __init__(self, seed=3, days=21, start=1_790_000_000 - 1_790_000_000 % 7200):
+        rng = np.random.default_rng(seed)
+        minutes = days * 24 * 60
+        price = 1000 * np.exp(np.cumsum(rng.normal(0, 0.002, minutes)))
+        self.start = start
+        self.times = start + 60 * np.arange(minutes)
+        self.fine = {"maxBuy": price * 1.01, "minBuy": price * 0.99, "maxSell": price * 1.03, "minSell": price,
+                     "buy": price, "sell": price * rng.uniform(1.0, 1.04, minutes),
+                     "sellVolume": rng.uniform(1e5, 2e5, minutes), "buyVolume": rng.uniform(1e5, 2e5, minutes)}
+
+    def history(self, horizon, now):
+        """The finished buckets of one horizon at now, like coflnet returns them"""
+        span, step = SPANS[horizon], STEPS[horizon]
+        end = now - now % step
+        out = []
+        for bucket in range(int(end - span), int(end), step):
+            inside = (self.times >= bucket) & (self.times < bucket + step)
+            if not inside.any():
+                continue
+            record = {field: float(self.AGGREGATES.get(field, np.mean)(self.fine[field][inside])) for field in FIELDS}
+            record["timestamp"] = stamp(bucket)
+            out.append(record)
+        return out
+
+
+def market_range_client(market, clock, in_progress=False):
+    """httpx client answering single_call's range endpoint from market's minutes at clock.now.
+
+    With in_progress the minute still going on at clock.now is in the answer too, the way a
+    live endpoint can hand out its open bucket.
+    """
+    import httpx
+
+    def handler(request):
+        start, end = (calendar.timegm(time.strptime(request.url.params[name], "%Y-%m-%dT%H:%M:%S"))
+                      for name in ("start", "end"))
+        end = min(end, clock.now if in_progress else clock.now - clock.now % 60 - 60)
+        inside = np.flatnonzero((market.times >= start) & (market.times <= end))
+        body = [{field: float(market.fine[field][i]) for field in FIELDS} | {"timestamp": stamp(market.times[i])}
+                for i in inside]
+        return httpx.Response(200, json=body)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def market_api(market, clock, item="X"):
+    """api_call.Api answering from market at clock.now, the horizons it was asked for are in .calls"""
+    from api_call import Api
+
+    class MarketApi(Api):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        async def call_api_async(self, client, horizon, parse=True):
+            self.calls.append(horizon)
+            history = market.history(horizon, clock.now)
+            return self.parse_history(history) if parse else json.dumps(history).encode()
+
+    api = MarketApi()
+    api.set_api_item(item)
+    return api
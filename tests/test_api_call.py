@@ -0,0 +1,76 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from api_call import FIELDS, Item as ApiItem
+from Bazaar_Algo import Item, Main
+from synthetic import list_item, product, records
+
+SERIES = ("_maxSell", "_maxBuy", "_min_buy", "_minSell", "_buy", "_sell", "_sellvolume", "_buyvolume")
+
+
+def array_item(history):
+    return Item(*[ApiItem.from_records(history).get_columns()[row] for row in range(len(FIELDS))])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_summaries_match_the_list_implementation(seed):
+    rng = random.Random(seed)
+    history = records(rng, rng.randint(0, 300), gaps=0.05)
+    lists, arrays = list_item(history), array_item(history)
+    for series in SERIES:
+        expected, actual = lists.summary(series), arrays.summary(series)
+        for name in ("count", "sum", "mean", "median", "min", "max", "trimmed_mean", "vwap"):
+            a, b = getattr(expected, name), getattr(actual, name)
+            assert (a is None) == (b is None), (series, name)
+            if a is not None:
+                assert math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-12), (series, name)
+        assert math.isclose(expected.percentile(0.9), actual.percentile(0.9), rel_tol=1e-12)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_metrics_match_the_list_implementation(seed):
+    rng = random.Random(100 + seed)
+    histories = product(rng, gaps=0.03)
+    expected = Main().metrics_from_items(*(list_item(history) for history in histories), "P")
+    actual = Main().build_metrics(tuple(ApiItem.from_records(history) for history in histories), "P")
+    assert actual.keys() == expected.keys()
+    for name, value in expected.items():
+        if isinstance(value, str):
+            assert actual[name] == value
+        else:
+            assert math.isclose(actual[name], value, rel_tol=1e-12, abs_tol=1e-12), name
+
+
+def test_from_records_marks_missing_and_unreadable_values():
+    history = records(random.Random(1), 3)
+    history[0]["buy"] = None
+    history[1]["sell"] = "n/a"
+    del history[2]["maxBuy"]
+    item = ApiItem.from_records(history)
+    assert np.isnan(item.get_buy()[0])
+    assert item.get_sell()[1] == 0.0  # like Item.to_float
+    assert np.isnan(item.get_max_buy()[2])
+    assert item.get_columns().shape == (len(FIELDS), 3)
+
+
+def test_from_records_sorts_by_time():
+    history = records(random.Random(2), 50, step=300)
+    history[10]["timestamp"] = None
+    shuffled = history[::-1]
+    forward, backward = ApiItem.from_records(history), ApiItem.from_records(shuffled)
+    times = backward.get_timestamps()
+    assert np.all(np.diff(times[:backward.time_index().dated]) > 0)
+    assert np.isnan(times[-1])  # the undated sample goes last
+    assert np.array_equal(forward.get_timestamps(), times, equal_nan=True)
+    assert np.array_equal(forward.get_columns(), backward.get_columns(), equal_nan=True)
+
+
+def test_time_ranges():
+    history = records(random.Random(3), 12, start=0, step=600)
+    item = ApiItem.from_records(history)
+    assert len(item.between(1200, 3000)) == 3
+    assert item.last(1800).get_timestamps().tolist() == [5400.0, 6000.0, 6600.0]
+    assert len(item.between(10_000)) == 0
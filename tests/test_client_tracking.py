@@ -0,0 +1,51 @@
+import asyncio
+
+from client_tracking import TrackingCache
+
+
+async def settle(tracker, messages):
+    """Waits until the listener has seen messages invalidation pushes"""
+    for _ in range(200):
+        if tracker.stats()["invalidation_messages"] >= messages:
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_tracked_reads_come_from_memory_until_redis_says_otherwise(redis_run, redis_url):
+    async def test(client, prefix):
+        tracker = TrackingCache(redis_url)
+        await tracker.start()
+        try:
+            await client.set(prefix, "old")
+            assert await tracker.get(prefix) == b"old"
+            assert await tracker.get(prefix) == b"old"
+            assert tracker.stats()["hits"] == 1 and tracker.stats()["misses"] == 1
+            await client.set(prefix, "new")  # another worker writes
+            await settle(tracker, 1)
+            assert await tracker.get(prefix) == b"new"
+            assert tracker.stats()["invalidations"] == 1
+        finally:
+            await tracker.stop()
+
+    redis_run(test)
+
+
+def test_get_many_tracks_every_key_it_fetched(redis_run, redis_url):
+    async def test(client, prefix):
+        tracker = TrackingCache(redis_url)
+        await tracker.start()
+        try:
+            keys = [f"{prefix}:{i}" for i in range(3)]
+            await client.set(keys[0], "a")
+            await client.set(keys[1], "b")
+            assert await tracker.get_many(keys) == [b"a", b"b", None]
+            assert await tracker.get_many(keys[:2]) == [b"a", b"b"]
+            assert tracker.stats()["hits"] == 2
+            await client.set(keys[1], "c")
+            await client.set(keys[2], "d")  # not cached, a missing key isn't kept
+            await settle(tracker, 1)
+            assert await tracker.get_many(keys) == [b"a", b"c", b"d"]
+        finally:
+            await tracker.stop()
+
+    redis_run(test)
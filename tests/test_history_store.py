@@ -0,0 +1,66 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+from Bazaar_Algo import Main
+from history_store import HistoryStore
+from synthetic import market_api
+
+
+def fetch(store, api):
+    return asyncio.run(store.fetch(api, None))
+
+
+def assert_same_views(stored, fresh):
+    for a, b in zip(stored, fresh):
+        assert np.array_equal(a.get_timestamps(), b.get_timestamps())
+        assert np.allclose(a.get_columns(), b.get_columns(), rtol=1e-9, equal_nan=True)
+    expected, actual = Main().build_metrics(fresh, "X"), Main().build_metrics(stored, "X")
+    for name, value in expected.items():
+        if not isinstance(value, str):
+            assert math.isclose(actual[name], value, rel_tol=1e-9, abs_tol=1e-12), name
+
+
+@pytest.mark.parametrize("offset", [0, 1800, 5400, 6600])
+def test_hour_refreshes_match_a_fresh_three_call_fetch(market, clock, offset):
+    clock.now += offset  # how far into the open 2 hour week bucket the seed lands
+    store, api = HistoryStore(), market_api(market, clock)
+    fetch(store, api)
+    assert len(api.calls) == 3
+    for _ in range(30):  # five hours of ten minute refreshes, the reseed is due after six
+        clock.now += 600
+        incremental = store.incremental("X")
+        api.calls.clear()
+        stored = fetch(store, api)
+        assert sorted(api.calls) == (["hour"] if incremental else ["day", "hour", "week"])
+        assert_same_views(stored, asyncio.run(market_api(market, clock).call_api_all(None)))
+    # a seed over an hour into the week bucket can't finish it from the hour samples, one full fetch does
+    full = 1 if offset > 3600 else 0
+    assert store.stats()["expired"] == full
+    assert store.stats()["increments"] == 30 - full and store.stats()["gaps"] == 0
+
+
+def test_a_history_too_old_to_overlap_skips_the_hour_call(market, clock):
+    store, api = HistoryStore(), market_api(market, clock)
+    fetch(store, api)
+    clock.now += 3700  # the refresh queue's max interval is hours, this happens all the time
+    assert not store.incremental("X")
+    api.calls.clear()
+    stored = fetch(store, api)
+    assert sorted(api.calls) == ["day", "hour", "week"]  # three calls, not the hour one on top
+    assert store.stats()["gaps"] == 0 and store.stats()["expired"] == 1
+    assert_same_views(stored, asyncio.run(market_api(market, clock).call_api_all(None)))
+    clock.now += 600
+    assert store.incremental("X")
+
+
+def test_incremental_predicts_the_calls_a_fetch_makes(market, clock):
+    store, api = HistoryStore(reseed_interval=6 * 3600), market_api(market, clock)
+    for spacing in (600, 3700, 1800, 3300, 5000, 60, 7200, 2400, 3500, 3000, 900, 3600):
+        predicted = 1 if store.incremental("X") else 3
+        api.calls.clear()
+        fetch(store, api)
+        assert len(api.calls) == predicted
+        clock.now += spacing
@@ -0,0 +1,128 @@
+import asyncio
+import random
+
+import numpy as np
+import pytest
+
+from api_call import FIELDS, Item
+from history_store import HistoryStore
+from hourly_summaries import PERCENTILES, VOLUMES, HourlySummaries
+from synthetic import market_api, records
+from time_index import HOUR
+
+START = 1_790_000_000 - 1_790_000_000 % HOUR
+RANK_ERROR = 0.03  # of a merged window's percentiles, one hour alone is sketched coarser
+HOUR_RANK_ERROR = 0.06  # about a dozen centroids for an hour's 60 samples
+
+
+def minute_item(rng, hours, gaps=0.0, start=START):
+    return Item.from_records(records(rng, hours * 60, start=start, step=60, gaps=gaps))
+
+
+def direct(item, start, end):
+    """What a window over [start, end) should say, straight from the samples"""
+    times, columns = item.get_timestamps(), item.get_columns()
+    inside = (times >= start) & (times < end)
+    out = {}
+    for row, field in enumerate(FIELDS):
+        values = columns[row, inside]
+        values = values[~np.isnan(values)]
+        if not len(values):
+            out[field] = None
+            continue
+        out[field] = {"count": len(values), "mean": values.mean(), "std": values.std(),
+                      "min": values.min(), "max": values.max(), "values": values}
+        if row in VOLUMES:
+            prices, volumes = columns[row, inside], columns[VOLUMES[row], inside]
+            paired = ~np.isnan(prices) & ~np.isnan(volumes)
+            out[field]["vwap"] = np.dot(prices[paired], volumes[paired]) / volumes[paired].sum()
+    return out
+
+
+def assert_window_matches(bucket, expected):
+    for field, want in expected.items():
+        got = bucket.series(field)
+        if want is None:
+            assert got is None, field
+            continue
+        assert got["count"] == want["count"], field
+        for name in ("mean", "std", "min", "max"):
+            assert got[name] == pytest.approx(want[name], rel=1e-9), (field, name)
+        if "vwap" in want:
+            assert got["vwap"] == pytest.approx(want["vwap"], rel=1e-9), field
+            error = HOUR_RANK_ERROR if want["count"] <= 60 else RANK_ERROR
+            for name, q in PERCENTILES.items():  # a sketch, so judged by where its answer ranks among the values
+                below, upto = np.mean(want["values"] < got[name]), np.mean(want["values"] <= got[name])
+                assert below - error <= q <= upto + error, (field, name)
+
+
+@pytest.mark.parametrize("gaps", [0.0, 0.1])
+def test_merged_hours_match_a_direct_computation(gaps):
+    item = minute_item(random.Random(1), 48, gaps)
+    summaries = HourlySummaries()
+    assert summaries.add(item, 60) == 48 * 60
+    assert len(summaries) == 48
+    for first, last in ((0, 1), (0, 48), (5, 29), (47, 48), (12, 36)):
+        start, end = START + first * HOUR, START + last * HOUR
+        assert_window_matches(summaries.window(start, end), direct(item, start, end))
+    assert summaries.window(START + 48 * HOUR) is None
+
+
+def test_adding_in_pieces_is_the_same_as_adding_at_once():
+    item = minute_item(random.Random(2), 10)
+    whole, pieces = HourlySummaries(), HourlySummaries()
+    whole.add(item, 60)
+    for cut in (START + 1800, START + 4 * HOUR + 60, START + 7 * HOUR):  # mid hour cuts merge into the open bucket
+        pieces.add(item, 60, end=cut)
+    pieces.add(item, 60)
+    assert pieces.add(item, 60) == 0  # nothing newer left
+    a, b = whole.window(), pieces.window()
+    assert np.allclose(a.stats, b.stats, rtol=1e-12)
+    assert a.as_dict()["buy"]["vwap"] == pytest.approx(b.as_dict()["buy"]["vwap"], rel=1e-12)
+
+
+def test_retention_drops_the_oldest_hours():
+    summaries = HourlySummaries(retention=6)
+    item = minute_item(random.Random(3), 10)
+    summaries.add(item, 60)
+    assert len(summaries) == 6
+    assert summaries.window(end=START + 4 * HOUR) is None
+    assert_window_matches(summaries.trailing(6), direct(item, START + 4 * HOUR, START + 10 * HOUR))
+
+
+def fetch(store, api):
+    return asyncio.run(store.fetch(api, None))
+
+
+def test_store_summaries_count_each_sample_once_across_refreshes_and_reseeds(market, clock):
+    store, api = HistoryStore(hourly=True), market_api(market, clock)
+    fetch(store, api)
+    for spacing in [600] * 20 + [3700] + [600] * 12:  # ten minute refreshes with one long pause, a full fetch
+        clock.now += spacing
+        fetch(store, api)
+    assert store.stats()["expired"] == 1
+    hour = clock.now - clock.now % HOUR - 2 * HOUR  # well inside the refreshes after the pause, hour samples only
+    bucket = store.window("X", hour, hour + HOUR)
+    inside = (market.times >= hour) & (market.times < hour + HOUR)
+    assert bucket.series("buy")["count"] == 60
+    assert bucket.series("buy")["mean"] == pytest.approx(market.fine["buy"][inside].mean(), rel=1e-9)
+    assert bucket.series("buy")["max"] == pytest.approx(market.fine["buy"][inside].max(), rel=1e-12)
+    row = FIELDS.index("buy")
+    start = clock.now - clock.now % HOUR - 30 * HOUR  # day samples and hour samples, never more than an hour's worth
+    for offset in range(29):
+        bucket = store.window("X", start + offset * HOUR, start + (offset + 1) * HOUR)
+        assert 3300 <= bucket.stats[1, row] <= HOUR, offset
+
+
+def test_store_keeps_summaries_for_hourly_size_products(market, clock):
+    store = HistoryStore(hourly=True, hourly_size=2)
+    for item in ("A", "B", "C"):
+        fetch(store, market_api(market, clock, item))
+    assert not store.summarized("A") and store.summarized("B") and store.summarized("C")
+    assert store.window("A") is None
+    store.window("B")  # a read counts as a use, so C goes next
+    fetch(store, market_api(market, clock, "D"))
+    assert store.summarized("B") and not store.summarized("C")
+    stats = store.stats()
+    assert stats["hourly_products"] == 2 and stats["hourly_max_size"] == 2
+    assert stats["products"] == 4  # the histories have their own, larger bound
@@ -0,0 +1,92 @@
+import asyncio
+import math
+import random
+
+import pytest
+
+from api_call import Search
+from Bazaar_Algo import Main
+from market_algo import score_results
+from scoring import ScoringExecutor
+from synthetic import product, raw
+
+
+def scalar(item_result, search):
+    """Main.score_result, a ZeroDivisionError comes back instead of being raised"""
+    try:
+        return Main().score_result(item_result, search)
+    except ZeroDivisionError as e:
+        return e
+
+
+def assert_same(expected, actual):
+    if expected is False or isinstance(expected, Exception):
+        assert type(actual) is type(expected)
+        return
+    assert actual["Signal"] == expected["Signal"]
+    assert actual["metrics"].keys() == expected["metrics"].keys()
+    for name, value in expected["metrics"].items():
+        if isinstance(value, str):
+            assert actual["metrics"][name] == value
+        else:
+            assert math.isclose(actual["metrics"][name], value, rel_tol=1e-9, abs_tol=1e-9), name
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = random.Random(7)
+    parser = Search()
+    searches = [f"P{i}" for i in range(300)]
+    item_results = [parser.parse_results(raw(product(rng, gaps=0.02))) for _ in searches]
+    zero = product(rng)  # no buy price at all, the scalar path divides by zero
+    for history in zero:
+        for record in history:
+            record["buy"] = 0
+    item_results.append(parser.parse_results(raw(zero)))
+    searches.append("ZERO")
+    item_results.append(None)  # not found
+    searches.append("MISSING")
+    return item_results, searches
+
+
+def test_score_results_matches_main(catalog):
+    item_results, searches = catalog
+    vectorized = score_results(item_results, searches)
+    assert len(vectorized) == len(item_results)
+    for item_result, search, actual in zip(item_results, searches, vectorized):
+        assert_same(scalar(item_result, search), actual)
+    assert isinstance(vectorized[-2], ZeroDivisionError)
+    assert vectorized[-1] is False
+
+
+def test_score_results_flags_missing_horizon(catalog):
+    item_results, searches = catalog
+    day, hour, week = item_results[0]
+    result, = score_results([(day, None, week)], searches[:1])
+    assert isinstance(result, ValueError)
+
+
+def test_score_batch_matches_main():
+    rng = random.Random(11)
+    parser = Search()
+    bodies = [raw(product(rng, gaps=0.02)) for _ in range(40)]
+    searches = [f"P{i}" for i in range(len(bodies))]
+
+    async def batches():
+        executor = ScoringExecutor()
+        try:
+            from_raw = await executor.score_batch(list(zip(searches, bodies)), chunk_size=7)
+            parsed = [parser.parse_results(body) for body in bodies]
+            from_items = await executor.score_batch(list(zip(searches, parsed)), parsed=True)
+            broken = await executor.score_batch([("BROKEN", (b"not json", b"", b""))])
+            return from_raw, from_items, broken, executor.stats()
+        finally:
+            executor.shutdown()
+
+    from_raw, from_items, broken, stats = asyncio.run(batches())
+    for search, body, a, b in zip(searches, bodies, from_raw, from_items):
+        expected = scalar(parser.parse_results(body), search)
+        assert_same(expected, a)
+        assert_same(expected, b)
+    assert isinstance(broken[0], ValueError)  # the parse error, json's is a ValueError
+    assert stats["batches"] == 3 and stats["batch_items"] == 2 * len(bodies) + 1
@@ -0,0 +1,69 @@
+import asyncio
+import math
+
+import numpy as np
+
+from api_call import Item as ApiItem
+from Bazaar_Algo import Item, Main
+from history_store import HistoryStore
+from online_metrics import SERIES, RunningWindow
+from synthetic import market_api
+
+FIELDS = ("count", "mean", "median", "min", "max", "trimmed_mean", "vwap")
+
+
+def assert_close(a, b, name):
+    if a is None or b is None:
+        assert a is None and b is None, name
+    else:
+        assert math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9), name
+
+
+def test_running_window_matches_series_summary():
+    rng = np.random.default_rng(1)
+    count = 6000
+    columns = rng.lognormal(5, 1, (len(SERIES), count))
+    columns[rng.random(columns.shape) < 0.05] = np.nan  # prices and volumes left out here and there
+    times = np.arange(count) * 60.0
+    window = RunningWindow()
+    for start in range(0, count - 300, 37):
+        view = ApiItem(columns[:, start:start + 288].copy(), times[start:start + 288].copy())
+        window.extend(view)
+        assert len(window) == len(view)
+        expected = Item(*view.get_columns())
+        for series in SERIES:
+            a, b = window.summary(series), expected.summary(series)
+            for name in FIELDS:
+                assert_close(getattr(a, name), getattr(b, name), (start, series, name))
+    for series in ("_buy", "_maxSell"):
+        for q in (0.0, 0.05, 0.25, 0.5, 0.95, 1.0):
+            assert_close(window.summary(series).percentile(q), expected.summary(series).percentile(q), (series, q))
+
+
+def test_a_revised_newest_sample_replaces_the_old_one():
+    window = RunningWindow()
+    row = np.full(len(SERIES), 2.0)
+    window.add(0.0, row)
+    window.add(60.0, row)
+    window.add(60.0, row * 3)  # coflnet revised its latest bucket
+    assert not window.add(0.0, row)  # older than what we have
+    summary = window.summary("_buy")
+    assert summary.count == 2 and summary.mean == 4.0
+
+
+def test_online_metrics_match_build_metrics(market, clock):
+    store, api = HistoryStore(online=True), market_api(market, clock)
+    asyncio.run(store.fetch(api, None))
+    for _ in range(36):  # six hours of ten minute refreshes, the last one reseeds
+        clock.now += 600
+        stored = asyncio.run(store.fetch(api, None))
+        online = store.online_metrics("X")
+        assert [len(window) for window in online.windows] == [len(view) for view in stored]
+        main = Main()
+        expected, actual = main.build_metrics(stored, "X"), main.metrics_from_items(*online.items(), "X")
+        for name, value in expected.items():
+            if isinstance(value, str):
+                assert actual[name] == value
+            else:
+                assert_close(actual[name], value, name)
+        assert main.score(actual)["Signal"] == main.score(expected)["Signal"]
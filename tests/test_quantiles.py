@@ -0,0 +1,98 @@
+import random
+
+import numpy as np
+import pytest
+
+from quantiles import RunningQuantile, RunningTrimmedMean, TDigest, trim_count
+
+QUANTILES = (0.0, 0.05, 0.1, 0.5, 0.9, 0.95, 1.0)
+
+
+def trimmed_mean(values):
+    ordered = np.sort(values)
+    trim = trim_count(len(ordered))
+    return ordered[trim:len(ordered) - trim].mean()
+
+
+@pytest.mark.parametrize("ties", [False, True])
+def test_running_structures_match_numpy_under_adds_and_removes(ties):
+    rng = random.Random(5)
+    quantiles = {q: RunningQuantile(q) for q in QUANTILES}
+    trimmed = RunningTrimmedMean()
+    values = []
+    for _ in range(3000):
+        if values and rng.random() < 0.45:
+            value = values.pop(rng.randrange(len(values)))
+            for structure in (*quantiles.values(), trimmed):
+                structure.remove(value)
+        else:
+            value = float(rng.randint(0, 15)) if ties else rng.lognormvariate(5, 1)
+            values.append(value)
+            for structure in (*quantiles.values(), trimmed):
+                structure.add(value)
+        if not values:
+            assert trimmed.value() is None and quantiles[0.5].value() is None
+            continue
+        for q, structure in quantiles.items():
+            assert structure.value() == pytest.approx(np.percentile(values, q * 100), rel=1e-9, abs=1e-9)
+        assert trimmed.value() == pytest.approx(trimmed_mean(values), rel=1e-9, abs=1e-9)
+        assert len(trimmed) == len(values)
+
+
+def test_sliding_window_stays_exact_through_heap_rebuilds():
+    values = np.random.default_rng(0).lognormal(5, 1, 30_000).tolist()
+    size = 5_000
+    median, trimmed = RunningQuantile(0.5), RunningTrimmedMean()
+    for value in values[:size]:
+        median.add(value)
+        trimmed.add(value)
+    for i in range(size, len(values)):
+        median.add(values[i])
+        median.remove(values[i - size])
+        trimmed.add(values[i])
+        trimmed.remove(values[i - size])
+        if i % 2500 == 0:
+            window = values[i - size + 1:i + 1]
+            assert median.value() == pytest.approx(np.median(window), rel=1e-12)
+            assert trimmed.value() == pytest.approx(trimmed_mean(window), rel=1e-9)
+
+
+def test_trim_count_matches_the_summary_rule():
+    assert [trim_count(n) for n in (0, 5, 6, 19, 20, 100)] == [0, 0, 0, 0, 1, 5]
+
+
+def rank_error(values, estimate, q):
+    """How far outside the ranks estimate could have in values q lies, 0 if inside"""
+    return max(np.mean(values < estimate) - q, q - np.mean(values <= estimate), 0.0)
+
+
+@pytest.mark.parametrize("compression", [25, 100])
+def test_tdigest_quantiles_are_close_to_numpy(compression):
+    values = np.random.default_rng(1).lognormal(5, 1, 20_000)
+    digest = TDigest(values, compression=compression)
+    assert digest.count == len(values) and len(digest.means) <= compression
+    assert digest.quantile(0.0) == values.min() and digest.quantile(1.0) == values.max()
+    for q in (0.001, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 0.999):
+        assert rank_error(values, digest.quantile(q), q) <= 2 / compression, q
+
+
+def test_merged_tdigests_match_one_over_all_the_values():
+    rng = np.random.default_rng(2)
+    parts = [rng.normal(loc, 10, size) for loc, size in ((100, 3000), (140, 500), (80, 6000), (100, 60))]
+    weights = [1.0, 300.0, 60.0, 7200.0]  # like hours filled from minute, day and week samples
+    merged = TDigest.merged([TDigest(part, weight, 25) for part, weight in zip(parts, weights)], 100)
+    values = np.concatenate(parts)
+    expanded = np.repeat(values, np.concatenate([np.full(len(part), int(weight)) for part, weight in zip(parts, weights)]))
+    assert merged.count == pytest.approx(len(expanded))
+    assert merged.min == values.min() and merged.max == values.max()
+    for q in (0.05, 0.25, 0.5, 0.75, 0.95):
+        assert rank_error(expanded, merged.quantile(q), q) <= 0.03, q
+
+
+def test_tdigest_skips_missing_values_and_empty_digests():
+    digest = TDigest([np.nan, 3.0, np.nan, 1.0, 2.0])
+    assert digest.count == 3 and digest.quantile(0.5) == pytest.approx(2.0)
+    empty = TDigest([np.nan])
+    assert empty.quantile(0.5) is None and empty.min is None
+    assert TDigest.merged([empty, digest]).quantile(0.5) == pytest.approx(2.0)
+    assert TDigest.merged([empty]).quantile(0.5) is None
@@ -0,0 +1,65 @@
+import asyncio
+
+from redis_lock import RefreshLock
+
+
+def test_only_one_of_many_acquires_gets_the_lock(redis_run):
+    async def test(client, prefix):
+        lock = RefreshLock(lease_ms=2000)
+        tokens = await asyncio.gather(*(lock.acquire(client, prefix) for _ in range(8)))
+        held = [token for token in tokens if token is not None]
+        assert len(held) == 1
+        assert await client.get(lock.lock_key(prefix)) == held[0].encode()
+        assert lock.stats()["acquired"] == 1 and lock.stats()["contended"] == 7
+        assert await lock.release(client, prefix, held[0])
+        assert await client.get(lock.lock_key(prefix)) is None
+        assert await lock.acquire(client, prefix) is not None  # free again once released
+
+    redis_run(test)
+
+
+def test_release_after_a_lost_lease_leaves_the_new_holder_alone(redis_run):
+    async def test(client, prefix):
+        lock = RefreshLock(lease_ms=50)
+        first = await lock.acquire(client, prefix)
+        await asyncio.sleep(0.1)  # the lease runs out while we are still "refreshing"
+        second = await lock.acquire(client, prefix)
+        assert first is not None and second is not None and first != second
+        assert not await lock.release(client, prefix, first)
+        assert await client.get(lock.lock_key(prefix)) == second.encode()
+        assert lock.stats()["lost_leases"] == 1
+        assert await lock.release(client, prefix, second)
+
+    redis_run(test)
+
+
+def test_wait_for_returns_the_holders_value(redis_run):
+    async def test(client, prefix):
+        lock = RefreshLock(lease_ms=2000, wait_ms=2000, poll_ms=10)
+        key = f"signal:{prefix}"
+
+        async def holder():
+            token = await lock.acquire(client, prefix)
+            await asyncio.sleep(0.1)
+            await client.set(key, "computed", ex=5)
+            await lock.release(client, prefix, token)
+
+        async def waiter():
+            await asyncio.sleep(0.01)  # after the holder has the lock
+            assert await lock.acquire(client, prefix) is None
+            return await lock.wait_for(client, key)
+
+        _, value = await asyncio.gather(holder(), waiter())
+        assert value == b"computed"
+        assert lock.stats()["waits_served"] == 1
+
+    redis_run(test)
+
+
+def test_wait_for_gives_up_after_wait_ms(redis_run):
+    async def test(client, prefix):
+        lock = RefreshLock(wait_ms=100, poll_ms=10)
+        assert await lock.wait_for(client, f"signal:{prefix}") is None
+        assert lock.stats()["waits_timed_out"] == 1
+
+    redis_run(test)
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import signal_cache
+from local_cache import Invalidator, LocalCache
+from signal_cache import CacheEntry, SignalCache
+
+
+def test_entries_go_fresh_stale_then_missing(redis_run, monkeypatch):
+    async def test(client, prefix):
+        cache = SignalCache(soft_ttl=60, hard_ttl=600, jitter=0, beta=0)
+        await cache.set(client, prefix, '{"Signal": "Buy"}', delta=1.5)
+        assert 590 <= await client.ttl(prefix) <= 600  # redis drops it at the hard ttl
+        entry = await cache.get(client, prefix)
+        assert entry.value == '{"Signal": "Buy"}' and entry.delta == 1.5 and entry.is_fresh()
+
+        now = time.time()
+        monkeypatch.setattr(signal_cache.time, "time", lambda: now + 120)
+        entry = await cache.get(client, prefix)
+        assert not entry.is_fresh() and cache.needs_refresh(entry)
+        monkeypatch.setattr(signal_cache.time, "time", lambda: now + 700)
+        assert await cache.get(client, prefix) is None
+        stats = cache.stats()
+        assert (stats["fresh_hits"], stats["stale_hits"], stats["misses"], stats["writes"]) == (1, 1, 1, 1)
+
+    redis_run(test)
+
+
+def test_get_many_reads_present_and_missing_keys_at_once(redis_run):
+    async def test(client, prefix):
+        cache = SignalCache(jitter=0, beta=0)
+        keys = [f"{prefix}:{i}" for i in range(4)]
+        for key in keys[:2]:
+            await cache.set(client, key, key)
+        await client.set(keys[2], '{"Signal": "Watch"}')  # a plain signal from before the envelope
+        entries = await cache.get_many(client, [keys[3], *keys, keys[0]])
+        assert list(entries) == [keys[3], *keys[:3]]
+        assert entries[keys[0]].value == keys[0] and entries[keys[1]].value == keys[1]
+        assert entries[keys[2]].value == '{"Signal": "Watch"}' and not entries[keys[2]].is_fresh()
+        assert entries[keys[3]] is None
+        assert await cache.peek(client, keys[3]) is None and cache.stats()["misses"] == 1
+
+    redis_run(test)
+
+
+def test_a_write_drops_the_other_workers_local_copies(redis_run):
+    async def test(client, prefix):
+        locals_ = [LocalCache(), LocalCache()]
+        invalidators = [Invalidator(local, channel=f"{prefix}:invalidate") for local in locals_]
+        caches = [SignalCache(jitter=0, beta=0, local_cache=local, invalidator=invalidator)
+                  for local, invalidator in zip(locals_, invalidators)]
+        for invalidator in invalidators:
+            invalidator.start(client)
+        try:
+            await asyncio.sleep(0.1)  # subscribed
+            await caches[0].set(client, prefix, "old")
+            assert (await caches[1].get(client, prefix)).value == "old"
+            assert locals_[1].get(prefix) is not None  # worker 1 keeps a copy now
+            await caches[0].set(client, prefix, "new")
+            for _ in range(100):
+                if locals_[1].get(prefix) is None:
+                    break
+                await asyncio.sleep(0.01)
+            assert (await caches[1].get(client, prefix)).value == "new"
+            assert locals_[0].get(prefix) is not None  # the writer's own copy stays, it is the new one
+        finally:
+            for invalidator in invalidators:
+                await invalidator.stop()
+
+    redis_run(test)
+
+
+def test_entries_round_trip_through_redis(redis_run):
+    async def test(client, prefix):
+        entry = CacheEntry('{"Signal": "No"}', 100.0, 200.0, 0.25)
+        await client.set(prefix, entry.encode())
+        read = CacheEntry.decode(await client.get(prefix))
+        assert vars(read) == vars(entry)
+
+    redis_run(test)
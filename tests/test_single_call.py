@@ -0,0 +1,44 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+from Bazaar_Algo import Main
+from single_call import SingleCallApi, compare_modes
+from synthetic import market_api, market_range_client
+
+
+def single_call(market, clock, in_progress=False, parse=True):
+    api = SingleCallApi()
+    api.set_api_item("X")
+
+    async def call():
+        async with market_range_client(market, clock, in_progress) as client:
+            return await api.call_api_all(client, parse)
+
+    return api, asyncio.run(call())
+
+
+@pytest.mark.parametrize("in_progress", [False, True])
+def test_single_call_views_match_the_three_endpoints(market, clock, in_progress):
+    for _ in range(12):  # starts on a 2 hour boundary, then lands all over the buckets
+        three = asyncio.run(market_api(market, clock).call_api_all(None))
+        _, single = single_call(market, clock, in_progress)
+        for a, b in zip(single, three):
+            assert np.array_equal(a.get_timestamps(), b.get_timestamps())
+            assert np.allclose(a.get_columns(), b.get_columns(), rtol=1e-9)
+        result = compare_modes(three, single, "X")
+        assert result["signals"][0] == result["signals"][1]
+        assert all(difference < 1e-9 for _, _, difference in result["metrics"].values())
+        clock.now += 1111
+
+
+def test_raw_single_call_parses_to_the_same_views(market, clock):
+    clock.now += 1234
+    _, parsed = single_call(market, clock, in_progress=True)
+    api, raw = single_call(market, clock, in_progress=True, parse=False)
+    expected, actual = Main().build_metrics(parsed, "X"), Main().build_metrics(api.parse_results(raw), "X")
+    for name, value in expected.items():
+        if not isinstance(value, str):
+            assert math.isclose(actual[name], value, rel_tol=1e-12), name
@@ -0,0 +1,46 @@
+import asyncio
+
+from single_flight import SingleFlight
+
+
+def test_do_many_runs_new_keys_once_and_joins_in_flight_ones():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+        release = asyncio.Event()
+
+        async def single():
+            await release.wait()
+            return "single"
+
+        async def many(keys):
+            calls.append(list(keys))
+            await release.wait()
+            return {key: ValueError(key) if key == "bad" else key.lower() for key in keys}
+
+        first = asyncio.ensure_future(flight.do("A", single))
+        await asyncio.sleep(0)
+        batch = asyncio.ensure_future(flight.do_many(["A", "B", "bad"], many))
+        again = asyncio.ensure_future(flight.do_many(["B", "C"], many))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await batch, await again, calls, flight.stats()
+
+    first, batch, again, calls, stats = asyncio.run(scenario())
+    assert first == "single"
+    assert batch["A"] == "single" and batch["B"] == "b"
+    assert isinstance(batch["bad"], ValueError)
+    assert again == {"B": "b", "C": "c"}
+    assert calls == [["B", "bad"], ["C"]]
+    assert stats["executions"] == 4 and stats["coalesced"] == 2 and stats["errors"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_do_many_fails_every_key_when_the_work_raises():
+    async def scenario():
+        async def many(keys):
+            raise RuntimeError("upstream down")
+        return await SingleFlight().do_many(["A", "B"], many)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results.values())
@@ -0,0 +1,66 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from api_call import Item as ApiItem
+from Bazaar_Algo import Item, Main
+from market_algo import score_results
+from synthetic import list_item, product
+
+
+def item(buy, buy_volume):
+    empty = [[]] * 4
+    return Item(*empty, buy, [], [], buy_volume)
+
+
+def test_price_and_volume_are_paired_per_sample():
+    expected = (10 * 1 + 30 * 3) / (1 + 3)  # the sample without a price takes its volume with it
+    assert item([10, None, 30], [1, 2, 3]).summary("_buy").vwap == expected
+    assert item(np.array([10, np.nan, 30]), np.array([1, 2, 3.0])).summary("_buy").vwap == expected
+    assert item([10, 20, 30], [1, None, 3]).summary("_buy").vwap == expected  # and a volume without its price
+    assert item([None], [5]).summary("_buy").vwap is None
+    assert item([10, 20], [0, 0]).summary("_buy").vwap is None
+
+
+def assert_same_metrics(expected, actual):
+    for name, value in expected.items():
+        if isinstance(value, str):
+            assert actual[name] == value
+        else:
+            assert math.isclose(actual[name], value, rel_tol=1e-12, abs_tol=1e-12), name
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_sample_order_does_not_change_the_metrics(seed):
+    """coflnet's records in whatever order they come, with holes, give the same metrics as the
+    time sorted columns, the week VWAPs (docker's medium_buy / medium_sell) included"""
+    rng = random.Random(seed)
+    histories = product(rng, gaps=0.05)
+    newest_first = tuple(history[::-1] for history in histories)
+    expected = Main().build_metrics(tuple(ApiItem.from_records(history) for history in histories), "P")
+    assert_same_metrics(expected, Main().metrics_from_items(*(list_item(history) for history in newest_first), "P"))
+    for history in newest_first:
+        for series in ("_buy", "_sell"):
+            a = list_item(history).summary(series).vwap
+            b = list_item(history[::-1]).summary(series).vwap
+            assert (a is None and b is None) or math.isclose(a, b, rel_tol=1e-12)
+
+    vectorized, = score_results([tuple(ApiItem.from_records(history) for history in newest_first)], ["P"])
+    if not isinstance(vectorized, ZeroDivisionError):
+        assert_same_metrics(expected, vectorized["metrics"])
+
+
+def test_array_engine_pairs_like_the_summary():
+    rng = random.Random(5)
+    histories = product(rng)
+    for history in histories:
+        for record in history[::3]:
+            record["buy"] = None
+        for record in history[1::4]:
+            record["sellVolume"] = None
+    items = tuple(ApiItem.from_records(history) for history in histories)
+    expected = Main().score_result(items, "P")
+    actual, = score_results([items], ["P"])
+    assert_same_metrics(expected["metrics"], actual["metrics"])